@@ -1,8 +1,23 @@
 import os
-import logging
-import requests
-from prometheus_client import start_http_server, Gauge
+import ssl
+import gzip
+import json
+import hashlib
 import time
+import random
+import signal
+import sqlite3
+import asyncio
+import logging
+import threading
+import aiohttp
+from datetime import datetime, timezone, timedelta
+from http.server import ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from types import MappingProxyType
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.exposition import MetricsHandler, choose_encoder, gzip_accepted
 
 logging.basicConfig(
     level=logging.INFO,
@@ -10,203 +25,1792 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+DO_API_URL = os.getenv("DO_API_URL", "https://api.digitalocean.com")
 DO_API_TOKEN = os.getenv("DO_API_TOKEN", "")
+DO_ACCOUNTS = [name.strip() for name in os.getenv("DO_ACCOUNTS", "").split(",") if name.strip()]
+ACCOUNT_CONCURRENCY = int(os.getenv("ACCOUNT_CONCURRENCY", "4"))
 METRICS_PORT = int(os.getenv("METRICS_PORT", "8080"))
 POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", "3600"))
+BILLING_INTERVAL = int(os.getenv("BILLING_INTERVAL", str(POLL_INTERVAL)))
+INVENTORY_INTERVAL = int(os.getenv("INVENTORY_INTERVAL", str(POLL_INTERVAL)))
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "5"))
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "30"))
+CYCLE_TIMEOUT = float(os.getenv("CYCLE_TIMEOUT", "300"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "200"))
+PAGE_CONCURRENCY = int(os.getenv("PAGE_CONCURRENCY", "4"))
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", "4"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "60"))
+RATE_LIMIT_RESERVE = int(os.getenv("RATE_LIMIT_RESERVE", "100"))
+SPECS_LABEL = os.getenv("SPECS_LABEL", "true").lower() == "true"
+MAX_RESOURCE_SERIES = int(os.getenv("MAX_RESOURCE_SERIES", "0"))
+ENABLED_COLLECTORS = os.getenv(
+    "COLLECTORS", "balance,invoice,droplet,volume,loadbalancer,kubernetes,database,snapshot,reserved_ip"
+).split(",")
+INCREMENTAL_INVENTORY = "actions" in ENABLED_COLLECTORS
+RECONCILE_INTERVAL = int(os.getenv("RECONCILE_INTERVAL", "21600"))
+ACTION_PAGES_MAX = int(os.getenv("ACTION_PAGES_MAX", "5"))
+DATA_DIR = os.getenv("DATA_DIR", "/data")
+PRICING_CACHE_PATH = os.getenv("PRICING_CACHE_PATH", os.path.join(DATA_DIR, "pricing.json"))
+PRICING_TTL = int(os.getenv("PRICING_TTL", "86400"))
+PRICING_OVERRIDES = json.loads(os.getenv("PRICING_OVERRIDES", "") or "{}")
+RECORD_DIR = os.getenv("RECORD_DIR", "")
+HISTORY_PATH = os.getenv("HISTORY_PATH", os.path.join(DATA_DIR, "history.db"))
+HISTORY_INTERVAL = int(os.getenv("HISTORY_INTERVAL", "900"))
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "400"))
+LEDGER_PATH = os.getenv("LEDGER_PATH", os.path.join(DATA_DIR, "ledger.json"))
+LEDGER_CHECKPOINT_INTERVAL = int(os.getenv("LEDGER_CHECKPOINT_INTERVAL", "300"))
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", os.path.join(DATA_DIR, "snapshots"))
+SNAPSHOT_MAX_AGE = int(os.getenv("SNAPSHOT_MAX_AGE", "86400"))
+ACCRUAL_MAX_GAP = float(os.getenv("ACCRUAL_MAX_GAP", str(max(3600, 2 * min(BILLING_INTERVAL, INVENTORY_INTERVAL)))))
+KUBE_SERVICE_ACCOUNT_DIR = "/var/run/secrets/kubernetes.io/serviceaccount"
+KUBE_API_URL = os.getenv("KUBE_API_URL") or (
+    f"https://{os.environ['KUBERNETES_SERVICE_HOST']}:{os.getenv('KUBERNETES_SERVICE_PORT', '443')}"
+    if os.getenv("KUBERNETES_SERVICE_HOST") else ""
+)
+KUBE_ATTRIBUTION = os.getenv("KUBE_ATTRIBUTION", "true").lower() == "true" and bool(KUBE_API_URL)
+KUBE_WATCH_TIMEOUT = int(os.getenv("KUBE_WATCH_TIMEOUT", "300"))
+PVC_APP_LABELS = os.getenv("PVC_APP_LABELS", "app.kubernetes.io/name,cnpg.io/cluster,app").split(",")
+
+# Monthly USD list prices DigitalOcean exposes no API for
+PRICING_DEFAULTS = {
+    "volume_gb": 0.10,
+    "snapshot_gb": 0.06,
+    "loadbalancer_node": 12.00,
+    "lb-small": 12.00,
+    "lb-medium": 36.00,
+    "lb-large": 72.00,
+    "kubernetes_control_plane": 0.00,
+    "kubernetes_ha_control_plane": 40.00,
+    "reserved_ip_unassigned": 5.00,
+    "spaces_subscription": 5.00,
+    "db-s-1vcpu-1gb": 15.00,
+    "db-s-1vcpu-2gb": 30.00,
+    "db-s-2vcpu-4gb": 60.00,
+    "db-s-4vcpu-8gb": 120.00,
+    "db-s-6vcpu-16gb": 240.00,
+    "db-s-8vcpu-32gb": 480.00,
+}
+
+OTHER_RESOURCES = "_other"
 
-resource_cost = Gauge(
-    "do_cost_exporter_resource_cost",
-    "DigitalOcean resource cost per day",
-    ["resource_id", "resource_name", "resource_type", "specs", "region"]
+api_request_duration = Histogram(
+    "do_cost_exporter_api_request_duration_seconds",
+    "DigitalOcean API request latency",
+    ["account", "endpoint"]
 )
 
-billing_mtd = Gauge(
-    "do_cost_exporter_billing_mtd",
-    "DigitalOcean actual month-to-date billing from invoice",
-    ["category"]
+api_requests = Counter(
+    "do_cost_exporter_api_requests",
+    "DigitalOcean API requests by response status",
+    ["account", "endpoint", "status"]
 )
 
-billing_balance = Gauge(
-    "do_cost_exporter_billing_balance",
-    "DigitalOcean account balance info",
-    ["type"]
+api_response_bytes = Counter(
+    "do_cost_exporter_api_response_bytes",
+    "Bytes received from the DigitalOcean API",
+    ["account", "endpoint"]
 )
 
-def get_droplet_specs(droplet):
-    """Extract droplet specs in human-readable format"""
-    size = droplet.get("size", {})
-    cpu = size.get("vcpus", 0)
-    memory = size.get("memory", 0)
-    disk = size.get("disk", 0)
-    return f"{cpu}CPU {memory}MB RAM {disk}GB Disk"
+collection_duration = Histogram(
+    "do_cost_exporter_collection_duration_seconds",
+    "Duration of a full collection cycle",
+    ["account"],
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+)
 
+last_success = Gauge(
+    "do_cost_exporter_last_success_timestamp_seconds",
+    "Unix time of the last successful collection per source",
+    ["account", "source"]
+)
+
+collector_duration = Histogram(
+    "do_cost_exporter_collector_duration_seconds",
+    "Duration of one source collection",
+    ["account", "source"]
+)
+
+collector_errors = Counter(
+    "do_cost_exporter_collector_errors",
+    "Failed source collections",
+    ["account", "source"]
+)
+
+resources_processed = Gauge(
+    "do_cost_exporter_resources_processed",
+    "Resources processed by the last successful collection",
+    ["account", "resource_type"]
+)
+
+inventory_events = Counter(
+    "do_cost_exporter_inventory_events",
+    "Completed DigitalOcean actions seen in the actions feed",
+    ["account", "resource_type", "action"]
+)
+
+kube_objects = Gauge(
+    "do_cost_exporter_kubernetes_objects",
+    "Kubernetes objects held in the attribution cache",
+    ["kind"]
+)
+
+
+class ResourceRecord:
+    """Cost of a single DigitalOcean resource as seen by one collection cycle"""
+
+    __slots__ = ("resource_id", "name", "resource_type", "region", "cost", "vcpus", "memory_mb", "disk_gb", "size")
+
+    def __init__(self, resource_id, name, resource_type, region, cost, vcpus=0, memory_mb=0, disk_gb=0, size=""):
+        self.resource_id = resource_id
+        self.name = name
+        self.resource_type = resource_type
+        self.region = region
+        self.cost = cost
+        self.vcpus = vcpus
+        self.memory_mb = memory_mb
+        self.disk_gb = disk_gb
+        self.size = size
+
+    @property
+    def specs(self):
+        """Human-readable specs, as exposed in the specs label"""
+        if self.resource_type == "droplet":
+            return f"{self.vcpus}CPU {self.memory_mb}MB RAM {self.disk_gb}GB Disk"
+        if self.resource_type == "volume":
+            return f"{self.disk_gb}GB Storage"
+        if self.resource_type == "loadbalancer":
+            return "Load Balancer"
+        if self.resource_type == "snapshot":
+            return f"{self.disk_gb}GB Snapshot"
+        return self.size
+
+
+class Snapshot:
+    """Immutable result of the latest collections, keyed by source
+
+    Resource sources (droplet, volume, ...) map to a tuple of
+    ResourceRecord, billing sources (balance, invoice) to a tuple of
+    (label, amount) pairs. A source missing from a cycle because it failed
+    keeps its previous value. `attribution` joins the resources to
+    Kubernetes objects and is recomputed every cycle. `collected_at` is the
+    Unix time of the last collection that changed any source.
+    """
+
+    __slots__ = ("parts", "attribution", "collected_at")
+
+    def __init__(self, parts=None, attribution=None, collected_at=0):
+        self.parts = MappingProxyType(dict(parts or {}))
+        self.attribution = attribution
+        self.collected_at = collected_at
+
+    def merge(self, results):
+        """Return a new snapshot with the sources that were collected successfully"""
+        collected = {k: v for k, v in results.items() if v is not None}
+        if not collected:
+            return self
+        return Snapshot({**self.parts, **collected}, collected_at=time.time())
+
+    def resources(self):
+        for name, records in self.parts.items():
+            if name not in BILLING_SOURCES:
+                yield from records
+
+    def total_cost(self):
+        return sum(record.cost for record in self.resources())
+
+
+BILLING_SOURCES = ("balance", "invoice")
+
+
+class Attribution:
+    """Droplets and volumes of a snapshot joined to the Kubernetes objects using them
+
+    `nodes` holds (node, record) pairs and `claims` holds (namespace, pvc,
+    pv, app, record) tuples. `namespaces` sums the claims per namespace.
+    """
+
+    __slots__ = ("nodes", "claims", "namespaces")
+
+    def __init__(self, nodes, claims):
+        self.nodes = tuple(nodes)
+        self.claims = tuple(claims)
+        namespaces = {}
+        for namespace, *_, record in self.claims:
+            namespaces[namespace] = namespaces.get(namespace, 0) + record.cost
+        self.namespaces = MappingProxyType(namespaces)
+
+
+def limit_cardinality(records, budget):
+    """Keep the `budget` most expensive records, fold the rest into one `_other` record per type"""
+    if not budget or len(records) <= budget:
+        return records
+    records = sorted(records, key=lambda r: r.cost, reverse=True)
+    kept, folded = records[:budget], {}
+    for record in records[budget:]:
+        other = folded.get(record.resource_type)
+        if other is None:
+            other = folded[record.resource_type] = ResourceRecord(
+                OTHER_RESOURCES, OTHER_RESOURCES, record.resource_type, OTHER_RESOURCES, 0
+            )
+        other.cost += record.cost
+    return kept + list(folded.values())
+
+
+class CostCollector:
+    """Renders cost metrics from the latest snapshot of each account at scrape time
+
+    Series only exist for resources present in the current snapshot, so
+    deleted or recreated droplets and volumes disappear from /metrics instead
+    of accumulating in the registry. MAX_RESOURCE_SERIES applies per account.
+    Node, PVC and namespace costs come from the snapshot's Kubernetes
+    attribution, the *_cost_dollars_total counters from the ledger.
+    """
+
+    def __init__(self):
+        self.snapshots = MappingProxyType({})
+
+    def publish(self, account, snapshot):
+        self.snapshots = MappingProxyType({**self.snapshots, account: snapshot})
+        metrics_cache.invalidate()
+
+    def describe(self):
+        return self.families()
+
+    def collect(self):
+        snapshots = self.snapshots
+        families = self.families()
+        family = {f.name.removeprefix("do_cost_exporter_"): f for f in families}
+        resource_cost, billing_mtd, billing_balance = family["resource_cost"], family["billing_mtd"], family["billing_balance"]
+
+        for account, snapshot in snapshots.items():
+            family["snapshot_timestamp_seconds"].add_metric([account], snapshot.collected_at)
+            records = limit_cardinality(list(snapshot.resources()), MAX_RESOURCE_SERIES)
+            totals = ledger.totals.get(account)
+            for r in records:
+                labels = [account, r.resource_id, r.name, r.resource_type, r.region]
+                spent = totals and totals["resources"].get(f"{r.resource_type}/{r.resource_id}")
+                if spent is not None:
+                    family["resource_cost_dollars"].add_metric(labels, spent)
+                if SPECS_LABEL:
+                    labels.append(r.specs)
+                resource_cost.add_metric(labels, r.cost)
+                if not SPECS_LABEL and r.resource_id != OTHER_RESOURCES:
+                    key = [account, r.resource_id, r.resource_type]
+                    if r.vcpus:
+                        family["resource_vcpus"].add_metric(key, r.vcpus)
+                    if r.memory_mb:
+                        family["resource_memory_bytes"].add_metric(key, r.memory_mb * 1024 ** 2)
+                    if r.disk_gb:
+                        family["resource_disk_bytes"].add_metric(key, r.disk_gb * 1024 ** 3)
+
+            for category, amount in snapshot.parts.get("invoice", ()):
+                billing_mtd.add_metric([account, category], amount)
+            for balance_type, amount in snapshot.parts.get("balance", ()):
+                billing_balance.add_metric([account, balance_type], amount)
+
+            attribution = snapshot.attribution
+            if attribution is not None:
+                for node, r in attribution.nodes:
+                    family["node_cost"].add_metric([account, node, r.resource_id], r.cost)
+                for namespace, pvc, pv, app, r in attribution.claims:
+                    family["pvc_cost"].add_metric([account, namespace, pvc, pv, app, r.resource_id], r.cost)
+                for namespace, cost in attribution.namespaces.items():
+                    family["namespace_cost"].add_metric([account, namespace], cost)
+
+            if totals:
+                for resource_type, spent in totals["types"].items():
+                    family["resource_type_cost_dollars"].add_metric([account, resource_type], spent)
+                for namespace, spent in totals["namespaces"].items():
+                    family["namespace_cost_dollars"].add_metric([account, namespace], spent)
+
+        return families
+
+    @staticmethod
+    def families():
+        resource_labels = ["account", "resource_id", "resource_name", "resource_type", "region"]
+        if SPECS_LABEL:
+            resource_labels.append("specs")
+        families = [
+            GaugeMetricFamily(
+                "do_cost_exporter_resource_cost",
+                "DigitalOcean resource cost per day",
+                labels=resource_labels
+            ),
+            GaugeMetricFamily(
+                "do_cost_exporter_billing_mtd",
+                "DigitalOcean actual month-to-date billing from invoice",
+                labels=["account", "category"]
+            ),
+            GaugeMetricFamily(
+                "do_cost_exporter_billing_balance",
+                "DigitalOcean account balance info",
+                labels=["account", "type"]
+            ),
+            GaugeMetricFamily(
+                "do_cost_exporter_snapshot_timestamp_seconds",
+                "Unix time the served cost data was collected, older than the poll interval after a warm start",
+                labels=["account"]
+            ),
+            CounterMetricFamily(
+                "do_cost_exporter_resource_cost_dollars",
+                "DigitalOcean resource cost accrued since the resource was first seen",
+                labels=["account", "resource_id", "resource_name", "resource_type", "region"]
+            ),
+            CounterMetricFamily(
+                "do_cost_exporter_resource_type_cost_dollars",
+                "DigitalOcean cost accrued per resource type, deleted resources included",
+                labels=["account", "resource_type"]
+            ),
+        ]
+        if not SPECS_LABEL:
+            spec_labels = ["account", "resource_id", "resource_type"]
+            families += [
+                GaugeMetricFamily("do_cost_exporter_resource_vcpus", "Resource vCPU count", labels=spec_labels),
+                GaugeMetricFamily("do_cost_exporter_resource_memory_bytes", "Resource memory size", labels=spec_labels),
+                GaugeMetricFamily("do_cost_exporter_resource_disk_bytes", "Resource disk or volume size", labels=spec_labels),
+            ]
+        if KUBE_ATTRIBUTION:
+            families += [
+                GaugeMetricFamily(
+                    "do_cost_exporter_node_cost",
+                    "Kubernetes node cost per day, from its droplet",
+                    labels=["account", "node", "resource_id"]
+                ),
+                GaugeMetricFamily(
+                    "do_cost_exporter_pvc_cost",
+                    "PersistentVolumeClaim cost per day, from its volume",
+                    labels=["account", "namespace", "persistentvolumeclaim", "persistentvolume", "app", "resource_id"]
+                ),
+                GaugeMetricFamily(
+                    "do_cost_exporter_namespace_cost",
+                    "Namespace cost per day, from its PersistentVolumeClaims",
+                    labels=["account", "namespace"]
+                ),
+                CounterMetricFamily(
+                    "do_cost_exporter_namespace_cost_dollars",
+                    "Namespace cost accrued from its PersistentVolumeClaims",
+                    labels=["account", "namespace"]
+                ),
+            ]
+        return families
+
+
+cost_collector = CostCollector()
+REGISTRY.register(cost_collector)
+
+
+class RateLimitBudget:
+    """Request budget tracked from DigitalOcean's ratelimit-* response headers
+
+    Requests are held back until ratelimit-reset once fewer than `reserve`
+    calls remain, leaving headroom for other users of the same token.
+    """
+
+    def __init__(self, reserve):
+        self.reserve = reserve
+        self.remaining = None
+        self.reset = 0
+
+    async def acquire(self):
+        while self.remaining is not None and self.remaining <= self.reserve:
+            wait = self.reset - time.time()
+            if wait <= 0:
+                self.remaining = None
+                break
+            logger.warning(f"DO API rate limit budget spent ({self.remaining} left), waiting {wait:.0f}s for reset")
+            await asyncio.sleep(wait)
+        if self.remaining is not None:
+            self.remaining -= 1
+
+    def update(self, headers):
+        if "ratelimit-remaining" in headers:
+            self.remaining = int(headers["ratelimit-remaining"])
+            self.reset = float(headers.get("ratelimit-reset", 0))
+
+
+def is_retryable(error):
+    """Rate limiting, server errors and transport failures are worth retrying"""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (aiohttp.ClientError, TimeoutError))
+
+
+def retry_delay(attempt, error):
+    """Full-jitter exponential backoff, never shorter than what a 429 asks for"""
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    headers = getattr(error, "headers", None) or {}
+    if "Retry-After" in headers:
+        delay = max(delay, float(headers["Retry-After"]))
+    elif getattr(error, "status", None) == 429 and "ratelimit-reset" in headers:
+        delay = max(delay, float(headers["ratelimit-reset"]) - time.time())
+    return min(delay, RETRY_MAX_DELAY)
+
+
+def create_session():
+    """Pooled keep-alive HTTP session for the DigitalOcean API
+
+    A single session is shared by every request of every account and
+    collection cycle, so connections are reused instead of re-negotiating
+    TLS per endpoint.
+    """
+    return aiohttp.ClientSession(
+        base_url=DO_API_URL,
+        timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+        connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, keepalive_timeout=min(BILLING_INTERVAL, INVENTORY_INTERVAL) + 60),
+    )
+
+
+class DOClient:
+    """DigitalOcean API client for one account, on top of a shared session
+
+    The rate limit budget is tracked per account since DigitalOcean limits
+    each token separately.
+    """
+
+    def __init__(self, session, account, token):
+        self.session = session
+        self.account = account
+        self.token = token
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.budget = RateLimitBudget(RATE_LIMIT_RESERVE)
+
+    async def get(self, path, params=None, endpoint=None):
+        """GET a DigitalOcean API path and return the decoded JSON body
+
+        `endpoint` is the metrics label for the request, it defaults to the
+        path and must be set for paths embedding ids. 429, 5xx and transport
+        errors are retried up to MAX_RETRIES times with jittered backoff.
+        """
+        endpoint = endpoint or path
+        attempt = 0
+        while True:
+            await self.budget.acquire()
+            try:
+                return await self._get_once(path, params, endpoint)
+            except Exception as e:
+                if attempt >= MAX_RETRIES or not is_retryable(e):
+                    raise
+                delay = retry_delay(attempt, e)
+                logger.warning(f"{self.account}: {endpoint} failed ({e}), retry {attempt + 1}/{MAX_RETRIES} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _get_once(self, path, params, endpoint):
+        status = "error"
+        start = time.perf_counter()
+        try:
+            async with self.session.get(path, params=params, headers=self.headers) as response:
+                status = str(response.status)
+                self.budget.update(response.headers)
+                body = await response.read()
+                api_response_bytes.labels(account=self.account, endpoint=endpoint).inc(len(body))
+                response.raise_for_status()
+                if RECORD_DIR:
+                    self.record(path, params, response, body)
+                return json.loads(body)
+        finally:
+            api_request_duration.labels(account=self.account, endpoint=endpoint).observe(time.perf_counter() - start)
+            api_requests.labels(account=self.account, endpoint=endpoint, status=status).inc()
+
+    def record(self, path, params, response, body):
+        """Save a successful response as a replay fixture under RECORD_DIR/<account>/
+
+        The token is redacted from the body and only content and rate limit
+        headers are kept, so fixtures can be committed or shared.
+        """
+        page = (params or {}).get("page", 1)
+        name = path.strip("/").replace("/", "_") + (f"_page{page}" if page != 1 else "")
+        body = body.replace(self.token.encode(), b"REDACTED").decode(errors="replace")
+        try:
+            body = json.loads(body)
+        except ValueError:
+            pass
+        fixture = {
+            "path": path,
+            "params": params or {},
+            "status": response.status,
+            "headers": {k: v for k, v in response.headers.items() if k.lower().startswith(("content-type", "ratelimit-"))},
+            "body": body,
+        }
+        try:
+            write_atomic(os.path.join(RECORD_DIR, self.account, f"{name}.json"), json.dumps(fixture, indent=2).encode())
+        except OSError as e:
+            logger.warning(f"Failed to record {path}: {e}")
+
+    async def paginate(self, path, key):
+        """Yield every item of a paginated list endpoint
+
+        The first page gives meta.total, the remaining pages are then fetched
+        concurrently. At most PAGE_CONCURRENCY pages are in flight and each
+        page is yielded as soon as it arrives, so memory stays bounded by the
+        window rather than by the size of the fleet.
+        """
+        first = await self.get(path, params={"page": 1, "per_page": PAGE_SIZE})
+        items = first.get(key, [])
+        for item in items:
+            yield item
+
+        # The API may serve fewer items per page than asked for
+        total = first.get("meta", {}).get("total", 0)
+        page_size = len(items) or PAGE_SIZE
+        last_page = -(-total // page_size)
+        pages = iter(range(2, last_page + 1))
+        in_flight = set()
+
+        def schedule():
+            for page in pages:
+                in_flight.add(asyncio.ensure_future(
+                    self.get(path, params={"page": page, "per_page": PAGE_SIZE})
+                ))
+                if len(in_flight) >= PAGE_CONCURRENCY:
+                    break
+
+        schedule()
+        try:
+            while in_flight:
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                in_flight.difference_update(done)
+                schedule()
+                for task in done:
+                    for item in task.result().get(key, []):
+                        yield item
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+
+def write_atomic(path, data):
+    """Replace `path` with `data` so readers never see a partial file"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class PricingCatalog:
+    """DigitalOcean monthly prices indexed by (slug, region)
+
+    Droplet sizes come from /v2/sizes and are cached in PRICING_CACHE_PATH, so
+    restarts within PRICING_TTL need no API call. Block storage, snapshot and
+    load balancer prices have no API and come from PRICING_DEFAULTS merged
+    with PRICING_OVERRIDES.
+    """
+
+    def __init__(self, path, ttl, rates):
+        self.path = path
+        self.ttl = ttl
+        self.rates = rates
+        self.sizes = {}
+        self.fetched_at = 0
+        self.lock = asyncio.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                cached = json.load(f)
+            self.index(cached["sizes"])
+            self.fetched_at = cached["fetched_at"]
+            logger.info(f"Loaded {len(cached['sizes'])} sizes from pricing cache {self.path}")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable pricing cache {self.path}: {e}")
+
+    def index(self, sizes):
+        index = {}
+        for size in sizes:
+            price = float(size.get("price_monthly", 0))
+            index[(size["slug"], None)] = price
+            for region in size.get("regions", []):
+                index[(size["slug"], region)] = price
+        self.sizes = index
+
+    def is_stale(self):
+        return time.time() - self.fetched_at > self.ttl
+
+    async def refresh(self, client):
+        """Reload droplet sizes from the API once the cache is older than the TTL"""
+        async with self.lock:
+            if self.is_stale():
+                await self._refresh(client)
+
+    async def _refresh(self, client):
+        try:
+            sizes = [
+                {"slug": size["slug"], "price_monthly": size.get("price_monthly", 0), "regions": size.get("regions", [])}
+                async for size in client.paginate("/v2/sizes", "sizes")
+            ]
+            self.index(sizes)
+            self.fetched_at = time.time()
+            write_atomic(self.path, json.dumps({"fetched_at": self.fetched_at, "sizes": sizes}).encode())
+            logger.info(f"Refreshed pricing catalog with {len(sizes)} sizes")
+        except Exception as e:
+            logger.error(f"Failed to refresh pricing catalog: {e}")
+
+    def size_monthly(self, slug, region):
+        """Monthly price of a droplet size, None when the slug is unknown"""
+        price = self.sizes.get((slug, region))
+        if price is None:
+            price = self.sizes.get((slug, None))
+        return price
+
+    def load_balancer_monthly(self, lb):
+        """Monthly price of a load balancer from its node count or legacy size slug"""
+        if lb.get("size_unit"):
+            return lb["size_unit"] * self.rates["loadbalancer_node"]
+        return self.rates.get(lb.get("size"), self.rates["loadbalancer_node"])
+
+
+pricing = PricingCatalog(PRICING_CACHE_PATH, PRICING_TTL, {**PRICING_DEFAULTS, **PRICING_OVERRIDES})
+
+
+class HistoryStore:
+    """Daily cost history in a local SQLite database (WAL mode)
+
+    Each resource keeps one row per UTC day holding its latest daily cost,
+    and each billing category its latest month-to-date amount, so month or
+    quarter totals are a single indexed range scan (query() and billing()).
+    Rows are upserted at most every HISTORY_INTERVAL seconds per account.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS resource_cost (
+            day TEXT NOT NULL,
+            account TEXT NOT NULL,
+            resource_id TEXT NOT NULL,
+            resource_type TEXT NOT NULL,
+            resource_name TEXT NOT NULL,
+            region TEXT NOT NULL,
+            cost REAL NOT NULL,
+            PRIMARY KEY (day, account, resource_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS resource_cost_by_resource ON resource_cost (account, resource_id, day);
+        CREATE TABLE IF NOT EXISTS billing (
+            day TEXT NOT NULL,
+            account TEXT NOT NULL,
+            category TEXT NOT NULL,
+            amount REAL NOT NULL,
+            PRIMARY KEY (day, account, category)
+        ) WITHOUT ROWID;
+    """
+
+    GROUPS = ("day", "account", "resource_type", "resource_id", "region")
+
+    def __init__(self, path, interval, retention_days):
+        self.path = path
+        self.interval = interval
+        self.retention_days = retention_days
+        self.written_at = {}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(self.SCHEMA)
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def record(self, account, snapshot):
+        """Upsert the snapshot into today's rows, throttled to one write per interval"""
+        now = time.time()
+        if now - self.written_at.get(account, 0) < self.interval:
+            return
+        self.written_at[account] = now
+
+        day = datetime.now(timezone.utc).date().isoformat()
+        cutoff = (datetime.now(timezone.utc).date() - timedelta(days=self.retention_days)).isoformat()
+        with self.connect() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO resource_cost VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (day, account, r.resource_id, r.resource_type, r.name, r.region, r.cost)
+                    for r in snapshot.resources()
+                )
+            )
+            db.executemany(
+                "INSERT OR REPLACE INTO billing VALUES (?, ?, ?, ?)",
+                ((day, account, category, amount) for category, amount in snapshot.parts.get("invoice", ()))
+            )
+            db.execute("DELETE FROM resource_cost WHERE day < ?", (cutoff,))
+            db.execute("DELETE FROM billing WHERE day < ?", (cutoff,))
+
+    def query(self, start, end, by="resource_type", account=None, resource_type=None):
+        """Sum of daily costs between two ISO dates (inclusive), grouped by one column"""
+        if by not in self.GROUPS:
+            raise ValueError(f"by must be one of {', '.join(self.GROUPS)}")
+        sql = f"SELECT {by}, SUM(cost), COUNT(DISTINCT resource_id) FROM resource_cost WHERE day BETWEEN ? AND ?"
+        params = [start, end]
+        if account:
+            sql += " AND account = ?"
+            params.append(account)
+        if resource_type:
+            sql += " AND resource_type = ?"
+            params.append(resource_type)
+        sql += f" GROUP BY {by} ORDER BY 2 DESC"
+
+        with self.connect() as db:
+            rows = db.execute(sql, params).fetchall()
+        return {
+            "start": start,
+            "end": end,
+            "by": by,
+            "total": sum(row[1] for row in rows),
+            "groups": [{"key": row[0], "cost": row[1], "resources": row[2]} for row in rows],
+        }
+
+    def billing(self, start, end, account=None):
+        """Invoiced amounts per category between two ISO dates (inclusive)
+
+        Each month counts with its latest month-to-date amount in the range,
+        so whole months give their invoice totals. The total is the sum of
+        the "total" category.
+        """
+        # SQLite takes the bare columns from the row holding MAX(day)
+        sql = "SELECT category, substr(day, 1, 7), MAX(day), amount FROM billing WHERE day BETWEEN ? AND ?"
+        params = [start, end]
+        if account:
+            sql += " AND account = ?"
+            params.append(account)
+        sql += " GROUP BY account, category, substr(day, 1, 7)"
+
+        with self.connect() as db:
+            rows = db.execute(sql, params).fetchall()
+        categories, months = {}, {}
+        for category, month, _, amount in rows:
+            categories[category] = categories.get(category, 0) + amount
+            if category == "total":
+                months[month] = months.get(month, 0) + amount
+        return {
+            "start": start,
+            "end": end,
+            "total": categories.pop("total", 0),
+            "months": [{"month": month, "total": total} for month, total in sorted(months.items())],
+            "groups": [{"key": key, "amount": amount} for key, amount in sorted(categories.items(), key=lambda item: -item[1])],
+        }
+
+
+history = HistoryStore(HISTORY_PATH, HISTORY_INTERVAL, HISTORY_RETENTION_DAYS)
+
+
+class CostLedger:
+    """Dollars accrued per resource, resource type and namespace, exported as counters
+
+    Every cycle adds each resource's daily cost prorated to the time since
+    the previous cycle, so increase() over any window gives the cost of that
+    window without sum_over_time. Resources accrue from the cycle after they
+    are first seen and elapsed time is capped at `max_gap`. Totals are
+    checkpointed to `path` and on shutdown. Restored totals stay hidden until
+    the first cycle after a restart has accrued the time since the checkpoint,
+    so the counters are not exported below what was served before the restart.
+    """
+
+    def __init__(self, path, checkpoint_interval, max_gap):
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+        self.max_gap = max_gap
+        self.totals = MappingProxyType({})
+        self.restored = {}
+        self.accrued_at = {}
+        self.saved_at = 0
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                checkpoint = json.load(f)
+            self.accrued_at = checkpoint["accrued_at"]
+            self.restored = checkpoint["totals"]
+            logger.info(f"Loaded accrued costs of {len(self.restored)} accounts from {self.path}")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable cost ledger {self.path}: {e}")
+
+    def accrue(self, account, snapshot):
+        now = time.time()
+        last = self.accrued_at.get(account, now)
+        self.accrued_at[account] = now
+        fraction = min(max(now - last, 0), self.max_gap) / 86400
+
+        previous = (self.totals.get(account) or self.restored.pop(account, None)
+                    or {"resources": {}, "types": {}, "namespaces": {}})
+        seen = previous["resources"]
+        resources, types, namespaces = {}, dict(previous["types"]), dict(previous["namespaces"])
+        for r in snapshot.resources():
+            key = f"{r.resource_type}/{r.resource_id}"
+            spent = r.cost * fraction if key in seen else 0
+            resources[key] = seen.get(key, 0) + spent
+            types[r.resource_type] = types.get(r.resource_type, 0) + spent
+        if snapshot.attribution is not None:
+            for namespace, *_, r in snapshot.attribution.claims:
+                if f"{r.resource_type}/{r.resource_id}" in seen:
+                    namespaces[namespace] = namespaces.get(namespace, 0) + r.cost * fraction
+
+        self.totals = MappingProxyType({
+            **self.totals,
+            account: MappingProxyType({"resources": resources, "types": types, "namespaces": namespaces}),
+        })
+
+    def save(self, force=False):
+        """Checkpoint the totals, at most once per checkpoint interval unless forced"""
+        now = time.time()
+        if not force and now - self.saved_at < self.checkpoint_interval:
+            return
+        self.saved_at = now
+        checkpoint = {
+            "accrued_at": dict(self.accrued_at),
+            "totals": {**self.restored, **{account: dict(totals) for account, totals in self.totals.items()}},
+        }
+        try:
+            write_atomic(self.path, json.dumps(checkpoint).encode())
+        except OSError as e:
+            logger.warning(f"Failed to checkpoint cost ledger {self.path}: {e}")
+
+
+ledger = CostLedger(LEDGER_PATH, LEDGER_CHECKPOINT_INTERVAL, ACCRUAL_MAX_GAP)
+
+
+class SnapshotStore:
+    """Last published snapshot of each account, persisted for warm starts
+
+    Each account is written atomically to <directory>/<account>.json after
+    every cycle. On startup the saved snapshots are served right away, with
+    their original collected_at, until the first collection replaces them.
+    Snapshots older than `max_age` are ignored, as are parts of collectors
+    that are no longer enabled, which merge() would otherwise keep forever.
+    """
+
+    def __init__(self, directory, max_age):
+        self.directory = directory
+        self.max_age = max_age
+
+    def save(self, account, snapshot):
+        data = {
+            "collected_at": snapshot.collected_at,
+            "parts": {
+                name: [list(item) if name in BILLING_SOURCES else [getattr(item, slot) for slot in ResourceRecord.__slots__]
+                       for item in items]
+                for name, items in snapshot.parts.items()
+            },
+        }
+        attribution = snapshot.attribution
+        if attribution is not None:
+            data["nodes"] = [[node, r.resource_type, r.resource_id] for node, r in attribution.nodes]
+            data["claims"] = [[*claim, r.resource_type, r.resource_id] for *claim, r in attribution.claims]
+        try:
+            write_atomic(os.path.join(self.directory, f"{account}.json"), json.dumps(data).encode())
+        except OSError as e:
+            logger.warning(f"{account}: Failed to save snapshot: {e}")
+
+    def load(self):
+        """Return the saved snapshots by account"""
+        snapshots = {}
+        try:
+            names = sorted(os.listdir(self.directory))
+        except FileNotFoundError:
+            return snapshots
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            account = name.removesuffix(".json")
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    snapshot = self.restore(json.load(f))
+            except Exception as e:
+                logger.warning(f"{account}: Ignoring unreadable snapshot: {e}")
+                continue
+            age = time.time() - snapshot.collected_at
+            if age > self.max_age:
+                logger.info(f"{account}: Ignoring snapshot collected {age:.0f}s ago")
+                continue
+            snapshots[account] = snapshot
+            logger.info(f"{account}: Restored snapshot collected {age:.0f}s ago")
+        return snapshots
+
+    @staticmethod
+    def restore(data):
+        parts = {
+            name: tuple(tuple(item) if name in BILLING_SOURCES else ResourceRecord(*item) for item in items)
+            for name, items in data["parts"].items() if name in SOURCES
+        }
+        attribution = None
+        if "nodes" in data:
+            records = {
+                (r.resource_type, r.resource_id): r
+                for name, items in parts.items() if name not in BILLING_SOURCES for r in items
+            }
+            attribution = Attribution(
+                [(node, records[t, i]) for node, t, i in data["nodes"] if (t, i) in records],
+                [(ns, pvc, pv, app, records[t, i]) for ns, pvc, pv, app, t, i in data["claims"] if (t, i) in records],
+            )
+        return Snapshot(parts, attribution, data["collected_at"])
+
+
+snapshot_store = SnapshotStore(SNAPSHOT_DIR, SNAPSHOT_MAX_AGE)
+
+
+class KubeCache:
+    """Nodes, PersistentVolumes and PersistentVolumeClaims mirrored from the Kubernetes API
+
+    Each kind is listed once and then kept current with a watch, so joining
+    a snapshot to the cluster needs no API call: droplet ids map to nodes
+    through spec.providerID (digitalocean://<id>), volume ids to PVs through
+    the CSI volumeHandle and PVs to their PVC through claimRef. Only the
+    fields used by the join are kept.
+    """
+
+    KINDS = {
+        "nodes": "/api/v1/nodes",
+        "persistentvolumes": "/api/v1/persistentvolumes",
+        "persistentvolumeclaims": "/api/v1/persistentvolumeclaims",
+    }
+
+    def __init__(self, url, service_account_dir):
+        self.url = url
+        self.token_path = os.path.join(service_account_dir, "token")
+        self.ca_path = os.path.join(service_account_dir, "ca.crt")
+        self.objects = {kind: {} for kind in self.KINDS}
+        self.node_by_droplet = {}
+        self.pv_by_volume = {}
+        self.listed = set()
+        self.ready = asyncio.Event()
+
+    def headers(self):
+        # Projected service account tokens rotate, so read it for every request
+        try:
+            with open(self.token_path) as f:
+                return {"Authorization": f"Bearer {f.read().strip()}"}
+        except FileNotFoundError:
+            return {}
+
+    def create_session(self):
+        ssl_context = ssl.create_default_context(cafile=self.ca_path) if os.path.exists(self.ca_path) else None
+        return aiohttp.ClientSession(
+            base_url=self.url,
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+            connector=aiohttp.TCPConnector(ssl=ssl_context) if ssl_context else None,
+            # Watch events carry whole objects on one line, nodes can be large
+            read_bufsize=2 ** 20,
+        )
+
+    @staticmethod
+    def strip(kind, obj):
+        """Reduce an API object to (key, fields used by the join)"""
+        meta = obj["metadata"]
+        spec = obj.get("spec") or {}
+        if kind == "nodes":
+            provider_id = spec.get("providerID", "")
+            droplet_id = provider_id.removeprefix("digitalocean://") if provider_id.startswith("digitalocean://") else None
+            return meta["name"], {"droplet_id": droplet_id}
+        if kind == "persistentvolumes":
+            claim = spec.get("claimRef")
+            return meta["name"], {
+                "volume_handle": (spec.get("csi") or {}).get("volumeHandle"),
+                "claim": f"{claim['namespace']}/{claim['name']}" if claim else None,
+            }
+        labels = meta.get("labels") or {}
+        app = next((labels[key] for key in PVC_APP_LABELS if labels.get(key)), "")
+        return f"{meta['namespace']}/{meta['name']}", {"app": app}
+
+    def index(self, kind, key, fields, add=True):
+        if kind == "nodes" and fields["droplet_id"]:
+            index, value = self.node_by_droplet, fields["droplet_id"]
+        elif kind == "persistentvolumes" and fields["volume_handle"]:
+            index, value = self.pv_by_volume, fields["volume_handle"]
+        else:
+            return
+        if add:
+            index[value] = key
+        elif index.get(value) == key:
+            del index[value]
+
+    def put(self, kind, key, fields):
+        previous = self.objects[kind].get(key)
+        if previous is not None:
+            self.index(kind, key, previous, add=False)
+        self.objects[kind][key] = fields
+        self.index(kind, key, fields)
+
+    def remove(self, kind, key):
+        previous = self.objects[kind].pop(key, None)
+        if previous is not None:
+            self.index(kind, key, previous, add=False)
+
+    async def list(self, session, kind):
+        """Replace the cached objects of a kind, returns the list resourceVersion"""
+        objects, params = {}, {"limit": "500"}
+        while True:
+            async with session.get(self.KINDS[kind], params=params, headers=self.headers()) as response:
+                response.raise_for_status()
+                body = await response.json()
+            for obj in body.get("items", []):
+                key, fields = self.strip(kind, obj)
+                objects[key] = fields
+            params["continue"] = body["metadata"].get("continue")
+            if not params["continue"]:
+                break
+
+        for key, fields in self.objects[kind].items():
+            self.index(kind, key, fields, add=False)
+        self.objects[kind] = {}
+        for key, fields in objects.items():
+            self.put(kind, key, fields)
+        kube_objects.labels(kind=kind).set(len(objects))
+        return body["metadata"]["resourceVersion"]
+
+    async def watch(self, session, kind, version):
+        """Apply watch events from `version` on, returns the last version seen or None once it expired"""
+        params = {
+            "watch": "1",
+            "resourceVersion": version,
+            "allowWatchBookmarks": "true",
+            "timeoutSeconds": str(KUBE_WATCH_TIMEOUT),
+        }
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=KUBE_WATCH_TIMEOUT + 30)
+        async with session.get(self.KINDS[kind], params=params, headers=self.headers(), timeout=timeout) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                obj = event["object"]
+                if event["type"] == "ERROR":
+                    if obj.get("code") == 410:
+                        return None
+                    raise RuntimeError(obj.get("message", "watch error"))
+                version = obj["metadata"]["resourceVersion"]
+                if event["type"] == "BOOKMARK":
+                    continue
+                key, fields = self.strip(kind, obj)
+                if event["type"] == "DELETED":
+                    self.remove(kind, key)
+                else:
+                    self.put(kind, key, fields)
+                kube_objects.labels(kind=kind).set(len(self.objects[kind]))
+        return version
+
+    async def sync(self, session, kind):
+        """List then watch one kind forever, relisting when the watch expires or fails"""
+        version, failures = None, 0
+        while True:
+            try:
+                if version is None:
+                    version = await self.list(session, kind)
+                    self.listed.add(kind)
+                    if len(self.listed) == len(self.KINDS):
+                        self.ready.set()
+                version = await self.watch(session, kind, version)
+                failures = 0
+            except Exception as e:
+                delay = retry_delay(failures, e)
+                logger.warning(f"Kubernetes {kind} watch failed ({e}), relisting in {delay:.1f}s")
+                version, failures = None, min(failures + 1, MAX_RETRIES)
+                await asyncio.sleep(delay)
+
+    async def run(self):
+        async with self.create_session() as session:
+            async with asyncio.TaskGroup() as group:
+                for kind in self.KINDS:
+                    group.create_task(self.sync(session, kind))
+
+    def attribute(self, snapshot):
+        """Return the snapshot with its droplets and volumes joined to nodes and PVCs"""
+        pvs, pvcs = self.objects["persistentvolumes"], self.objects["persistentvolumeclaims"]
+        nodes, claims = [], []
+        for record in snapshot.resources():
+            if record.resource_type == "droplet":
+                node = self.node_by_droplet.get(record.resource_id)
+                if node is not None:
+                    nodes.append((node, record))
+            elif record.resource_type == "volume":
+                pv = self.pv_by_volume.get(record.resource_id)
+                claim = pvs.get(pv, {}).get("claim")
+                if claim:
+                    namespace, name = claim.split("/", 1)
+                    pvc = pvcs.get(claim)
+                    claims.append((namespace, name, pv, pvc["app"] if pvc else "", record))
+        return Snapshot(snapshot.parts, Attribution(nodes, claims), snapshot.collected_at)
+
+
+kube = KubeCache(KUBE_API_URL, KUBE_SERVICE_ACCOUNT_DIR) if KUBE_ATTRIBUTION else None
+
+
+class MetricsCache:
+    """Registry exposition rendered once per published snapshot
+
+    Cost data only changes when a snapshot is published, so the first scrape
+    afterwards renders the registry and every other scrape, from any number
+    of Prometheus replicas, is served the same bytes. Each format (text or
+    OpenMetrics, as negotiated from Accept) is rendered on first request and
+    gzipped once. Self metrics, process metrics included, are therefore as
+    of the last render.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.lock = threading.Lock()
+        self.responses = {}
+
+    def invalidate(self):
+        self.responses = {}
+
+    def get(self, accept, gzipped):
+        """Return (body, content type, ETag) for an Accept header"""
+        encoder, content_type = choose_encoder(accept)
+        key = (content_type, gzipped)
+        response = self.responses.get(key)
+        if response is not None:
+            return response
+
+        with self.lock:
+            responses = self.responses
+            if key not in responses:
+                plain = responses.get((content_type, False))
+                if plain is None:
+                    body = encoder(self.registry)
+                    etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+                    plain = responses[(content_type, False)] = (body, content_type, etag)
+                if gzipped:
+                    body, _, etag = plain
+                    responses[key] = (gzip.compress(body, compresslevel=6), content_type, f'{etag[:-1]}-gzip"')
+            return responses[key]
+
+
+metrics_cache = MetricsCache(REGISTRY)
+
+
+class ExporterHandler(MetricsHandler):
+    """Serves /metrics from the metrics cache plus cost history range queries
+
+    /metrics answers If-None-Match with 304 when the ETag still matches.
+    Scrapes filtered with name[] bypass the cache.
+
+    GET /api/v1/cost?start=YYYY-MM-DD&end=YYYY-MM-DD&by=resource_type
+    optionally filtered with account= and resource_type=, and
+    GET /api/v1/billing?start=YYYY-MM-DD&end=YYYY-MM-DD optionally filtered
+    with account=. start defaults to the first day of the current month and
+    end to today.
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/api/v1/cost":
+            return self.send_history(parse_qs(url.query), lambda start, end, arg: history.query(
+                start, end, arg("by", "resource_type"), arg("account"), arg("resource_type")))
+        if url.path == "/api/v1/billing":
+            return self.send_history(parse_qs(url.query), lambda start, end, arg: history.billing(
+                start, end, arg("account")))
+        if "name[]" in parse_qs(url.query):
+            return super().do_GET()
+        self.send_metrics()
+
+    def send_metrics(self):
+        gzipped = gzip_accepted(self.headers.get("Accept-Encoding"))
+        body, content_type, etag = metrics_cache.get(self.headers.get("Accept"), gzipped)
+
+        if_none_match = self.headers.get("If-None-Match", "")
+        if if_none_match.strip() == "*" or etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Vary", "Accept, Accept-Encoding")
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_history(self, params, query):
+        today = datetime.now(timezone.utc).date()
+
+        def arg(name, default=None):
+            return params.get(name, [default])[0]
+
+        try:
+            start = arg("start", today.replace(day=1).isoformat())
+            end = arg("end", today.isoformat())
+            for day in (start, end):
+                datetime.strptime(day, "%Y-%m-%d")
+            result = query(start, end, arg)
+            status = 200
+        except ValueError as e:
+            result, status = {"error": str(e)}, 400
+
+        body = json.dumps(result).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_http_server(port):
+    server = ThreadingHTTPServer(("", port), ExporterHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Collector:
+    """A source of the snapshot, collected concurrently with every other source
+
+    `name` keys the source in the snapshot and in COLLECTORS, `label` is used
+    in log lines and `interval` is the refresh interval in seconds.
+    """
+
+    name = None
+    label = None
+    interval = INVENTORY_INTERVAL
+
+    async def collect(self, client):
+        raise NotImplementedError
+
+
+class ResourceCollector(Collector):
+    """Collects one ResourceRecord per item of a paginated list endpoint
+
+    Collectors with an `action_type` can also be updated incrementally from
+    the actions feed: `refetch` actions reload the resource from
+    <path>/<id> (the body holds it under `item_key`) and `remove` actions
+    drop it.
+    """
+
+    path = None
+    key = None
+    action_type = None
+    item_key = None
+    refetch = ()
+    remove = ()
+
+    def record(self, item):
+        """Price an API item, returns None to skip it"""
+        raise NotImplementedError
+
+    async def apply(self, client, records, actions):
+        """Apply completed actions to the previous records and return the new ones"""
+        by_id = {record.resource_id: record for record in records}
+        stale = set()
+        for action in actions:
+            if action["resource_type"] != self.action_type:
+                continue
+            resource_id = str(action["resource_id"])
+            if action["type"] in self.remove:
+                by_id.pop(resource_id, None)
+                stale.discard(resource_id)
+            elif action["type"] in self.refetch:
+                stale.add(resource_id)
+
+        # Refetch concurrently, at most PAGE_CONCURRENCY at a time
+        slots = asyncio.Semaphore(PAGE_CONCURRENCY)
+
+        async def refetch(resource_id):
+            async with slots:
+                try:
+                    item = await client.get(f"{self.path}/{resource_id}", endpoint=f"{self.path}/{{id}}")
+                except aiohttp.ClientResponseError as e:
+                    if e.status != 404:
+                        raise
+                    return None
+            return item[self.item_key]
+
+        stale = list(stale)
+        for resource_id, item in zip(stale, await asyncio.gather(*map(refetch, stale))):
+            if item is None:
+                by_id.pop(resource_id, None)
+                continue
+            record = self.record(item)
+            if record is not None:
+                by_id[resource_id] = record
+
+        if stale or len(by_id) != len(records):
+            logger.info(f"Applied {len(actions)} actions: {len(by_id)} {self.label}, {len(stale)} reloaded")
+        return tuple(by_id.values())
+
+    async def collect(self, client):
+        records = []
+        async for item in client.paginate(self.path, self.key):
+            record = self.record(item)
+            if record is not None:
+                records.append(record)
+                logger.debug(f"{self.name} {record.name}: ${record.cost:.2f}/day")
+
+        logger.info(f"Processed {len(records)} {self.label}")
+        return tuple(records)
+
+
+COLLECTORS = {}
+
+
+def register(cls):
+    """Class decorator adding a collector to the registry"""
+    COLLECTORS[cls.name] = cls()
+    return cls
+
+
+def region_of(item):
+    region = item.get("region", "unknown")
+    return region.get("slug", "unknown") if isinstance(region, dict) else region
+
+
+@register
+class BalanceCollector(Collector):
+    name = "balance"
+    label = "balance"
+    interval = BILLING_INTERVAL
+
+    async def collect(self, client):
+        balance = await client.get("/v2/customers/my/balance")
 
-def collect_billing_metrics(headers):
-    """Collect actual billing data from DigitalOcean API"""
-    try:
-        balance = requests.get(
-            "https://api.digitalocean.com/v2/customers/my/balance",
-            headers=headers
-        ).json()
-        
         mtd_usage = float(balance.get("month_to_date_usage", 0))
         account_balance = float(balance.get("account_balance", 0))
-        
-        billing_balance.labels(type="month_to_date_usage").set(mtd_usage)
-        billing_balance.labels(type="account_balance").set(account_balance)
-        
+
         logger.info(f"Billing: MTD usage ${mtd_usage:.2f}, account balance ${account_balance:.2f}")
-        
-    except Exception as e:
-        logger.error(f"Failed to fetch balance: {e}")
-    
-    try:
-        invoices = requests.get(
-            "https://api.digitalocean.com/v2/customers/my/invoices",
-            headers=headers
-        ).json()
-        
+        return (("month_to_date_usage", mtd_usage), ("account_balance", account_balance))
+
+
+@register
+class InvoiceCollector(Collector):
+    name = "invoice"
+    label = "invoice summary"
+    interval = BILLING_INTERVAL
+
+    async def collect(self, client):
+        invoices = await client.get("/v2/customers/my/invoices")
+
         preview = invoices.get("invoice_preview", {})
         invoice_uuid = preview.get("invoice_uuid")
-        
-        if invoice_uuid:
-            summary = requests.get(
-                f"https://api.digitalocean.com/v2/customers/my/invoices/{invoice_uuid}/summary",
-                headers=headers
-            ).json()
-            
-            product_charges = summary.get("product_charges", {})
-            for item in product_charges.get("items", []):
-                category = item.get("name", "unknown").lower()
-                amount = float(item.get("amount", 0))
-                billing_mtd.labels(category=category).set(amount)
-                logger.debug(f"Billing {category}: ${amount:.2f}")
-            
-            taxes = summary.get("taxes", {})
-            tax_amount = float(taxes.get("amount", 0))
-            billing_mtd.labels(category="taxes").set(tax_amount)
-            
-            credits = summary.get("credits_and_adjustments", {})
-            credit_amount = float(credits.get("amount", 0))
-            billing_mtd.labels(category="credits").set(credit_amount)
-            
-            total = float(summary.get("amount", 0))
-            billing_mtd.labels(category="total").set(total)
-            
-            logger.info(f"Invoice breakdown: Droplets, Volumes, LBs, Taxes=${tax_amount:.2f}, Credits=${credit_amount:.2f}, Total=${total:.2f}")
-            
-    except Exception as e:
-        logger.error(f"Failed to fetch invoice summary: {e}")
-
-
-def collect_metrics():
-    headers = {"Authorization": f"Bearer {DO_API_TOKEN}"}
-    
-    if not DO_API_TOKEN:
-        logger.warning("DO_API_TOKEN not set - metrics will be 0")
-        return
-    
-    collect_billing_metrics(headers)
-    
-    total_cost = 0
-    
-    try:
-        droplets = requests.get(
-            "https://api.digitalocean.com/v2/droplets?per_page=200",
-            headers=headers
-        ).json()
-        
-        for droplet in droplets.get("droplets", []):
-            droplet_id = droplet.get("id")
-            droplet_name = droplet.get("name", f"droplet-{droplet_id}")
-            region = droplet.get("region", {}).get("slug", "unknown")
-            specs = get_droplet_specs(droplet)
-            
-            cost = droplet.get("size", {}).get("price_monthly", 0) / 30
-            
-            resource_cost.labels(
-                resource_id=str(droplet_id),
-                resource_name=droplet_name,
-                resource_type="droplet",
-                specs=specs,
-                region=region
-            ).set(cost)
-            
-            total_cost += cost
-            logger.debug(f"Droplet {droplet_name}: ${cost:.2f}/day")
-        
-        logger.info(f"Processed {len(droplets.get('droplets', []))} droplets")
-        
-    except Exception as e:
-        logger.error(f"Failed to fetch droplets: {e}")
-    
-    try:
-        volumes = requests.get(
-            "https://api.digitalocean.com/v2/volumes?per_page=200",
-            headers=headers
-        ).json()
-        
-        for volume in volumes.get("volumes", []):
-            volume_id = volume.get("id")
-            volume_name = volume.get("name", f"volume-{volume_id}")
-            region = volume.get("region", {}).get("slug", "unknown")
-            size_gb = volume.get("size_gigabytes", 0)
-            
-            cost = size_gb * 0.10 / 30
-            
-            resource_cost.labels(
-                resource_id=volume_id,
-                resource_name=volume_name,
-                resource_type="volume",
-                specs=f"{size_gb}GB Storage",
-                region=region
-            ).set(cost)
-            
-            total_cost += cost
-            logger.debug(f"Volume {volume_name}: ${cost:.2f}/day")
-        
-        logger.info(f"Processed {len(volumes.get('volumes', []))} volumes")
-        
-    except Exception as e:
-        logger.error(f"Failed to fetch volumes: {e}")
-    
+
+        if not invoice_uuid:
+            return ()
+
+        summary = await client.get(
+            f"/v2/customers/my/invoices/{invoice_uuid}/summary",
+            endpoint="/v2/customers/my/invoices/{invoice_uuid}/summary"
+        )
+        charges = {}
+
+        product_charges = summary.get("product_charges", {})
+        for item in product_charges.get("items", []):
+            category = item.get("name", "unknown").lower()
+            amount = float(item.get("amount", 0))
+            charges[category] = amount
+            logger.debug(f"Billing {category}: ${amount:.2f}")
+
+        taxes = summary.get("taxes", {})
+        tax_amount = float(taxes.get("amount", 0))
+        charges["taxes"] = tax_amount
+
+        credits = summary.get("credits_and_adjustments", {})
+        credit_amount = float(credits.get("amount", 0))
+        charges["credits"] = credit_amount
+
+        total = float(summary.get("amount", 0))
+        charges["total"] = total
+
+        logger.info(f"Invoice breakdown: Droplets, Volumes, LBs, Taxes=${tax_amount:.2f}, Credits=${credit_amount:.2f}, Total=${total:.2f}")
+        return tuple(charges.items())
+
+
+@register
+class ActionsCollector(Collector):
+    """New completed actions of the account since the last poll
+
+    Enabling it switches action-tracked collectors (droplets) to
+    incremental updates: they are fully listed every RECONCILE_INTERVAL and
+    in between their previous records are patched from the actions found by
+    each poll. The feed lists the newest actions first. The first poll of an
+    account only sets the cursor. Returns (complete, actions) where
+    `complete` is False when more than ACTION_PAGES_MAX pages of actions
+    arrived since the last poll, in which case the tracked collectors fall
+    back to a full list.
+    """
+
+    name = "actions"
+    label = "actions feed"
+
+    def __init__(self):
+        self.cursors = {}
+        self.seen = {}
+
+    async def collect(self, client):
+        account = client.account
+        cursor = self.cursors.get(account)
+        actions, complete = [], False
+        for page in range(1, ACTION_PAGES_MAX + 1):
+            body = await client.get("/v2/actions", params={"page": page, "per_page": PAGE_SIZE})
+            page_actions = body.get("actions", [])
+            actions.extend(page_actions)
+            if cursor is None or not page_actions or min(a["id"] for a in page_actions) <= cursor \
+                    or not body.get("links", {}).get("pages", {}).get("next"):
+                complete = True
+                break
+
+        if cursor is None:
+            self.cursors[account] = max((a["id"] for a in actions), default=0)
+            return True, ()
+
+        # Keep the cursor below actions still in progress so they are seen again once completed
+        fresh = [a for a in actions if a["id"] > cursor]
+        in_progress = [a["id"] for a in fresh if a.get("status") == "in-progress"]
+        seen = self.seen.get(account, set())
+        completed = sorted(
+            (a for a in fresh if a.get("status") == "completed" and a["id"] not in seen),
+            key=lambda a: a["id"]
+        )
+        new_cursor = min(in_progress) - 1 if in_progress else max((a["id"] for a in fresh), default=cursor)
+        self.cursors[account] = new_cursor
+        self.seen[account] = {a["id"] for a in fresh if a["id"] > new_cursor and a.get("status") != "in-progress"}
+
+        for action in completed:
+            inventory_events.labels(
+                account=account, resource_type=action.get("resource_type", "unknown"), action=action["type"]
+            ).inc()
+        return complete, tuple(
+            {"id": a["id"], "type": a["type"], "resource_type": a.get("resource_type"), "resource_id": a.get("resource_id")}
+            for a in completed
+        )
+
+
+@register
+class DropletCollector(ResourceCollector):
+    name = "droplet"
+    label = "droplets"
+    path = "/v2/droplets"
+    key = "droplets"
+    interval = RECONCILE_INTERVAL if INCREMENTAL_INVENTORY else INVENTORY_INTERVAL
+    action_type = "droplet"
+    item_key = "droplet"
+    refetch = ("create", "resize", "rename")
+    remove = ("destroy",)
+
+    def record(self, droplet):
+        droplet_id = droplet.get("id")
+        size = droplet.get("size", {})
+        region = region_of(droplet)
+        monthly = pricing.size_monthly(droplet.get("size_slug"), region)
+        if monthly is None:
+            monthly = size.get("price_monthly", 0)
+
+        return ResourceRecord(
+            resource_id=str(droplet_id),
+            name=droplet.get("name", f"droplet-{droplet_id}"),
+            resource_type="droplet",
+            region=region,
+            cost=monthly / 30,
+            vcpus=size.get("vcpus", 0),
+            memory_mb=size.get("memory", 0),
+            disk_gb=size.get("disk", 0),
+        )
+
+
+@register
+class VolumeCollector(ResourceCollector):
+    name = "volume"
+    label = "volumes"
+    path = "/v2/volumes"
+    key = "volumes"
+
+    def record(self, volume):
+        volume_id = volume.get("id")
+        size_gb = volume.get("size_gigabytes", 0)
+
+        return ResourceRecord(
+            resource_id=volume_id,
+            name=volume.get("name", f"volume-{volume_id}"),
+            resource_type="volume",
+            region=region_of(volume),
+            cost=size_gb * pricing.rates["volume_gb"] / 30,
+            disk_gb=size_gb,
+        )
+
+
+@register
+class LoadBalancerCollector(ResourceCollector):
+    name = "loadbalancer"
+    label = "load balancers"
+    path = "/v2/load_balancers"
+    key = "load_balancers"
+
+    def record(self, lb):
+        lb_id = lb.get("id")
+
+        return ResourceRecord(
+            resource_id=lb_id,
+            name=lb.get("name", f"lb-{lb_id}"),
+            resource_type="loadbalancer",
+            region=region_of(lb),
+            cost=pricing.load_balancer_monthly(lb) / 30,
+        )
+
+
+@register
+class KubernetesCollector(ResourceCollector):
+    """DOKS control plane fees, worker nodes are already counted as droplets"""
+
+    name = "kubernetes"
+    label = "kubernetes clusters"
+    path = "/v2/kubernetes/clusters"
+    key = "kubernetes_clusters"
+
+    def record(self, cluster):
+        ha = cluster.get("ha", False)
+        rate = "kubernetes_ha_control_plane" if ha else "kubernetes_control_plane"
+
+        return ResourceRecord(
+            resource_id=cluster.get("id"),
+            name=cluster.get("name", f"cluster-{cluster.get('id')}"),
+            resource_type="kubernetes",
+            region=region_of(cluster),
+            cost=pricing.rates[rate] / 30,
+            size="HA control plane" if ha else "Control plane",
+        )
+
+
+@register
+class DatabaseCollector(ResourceCollector):
+    name = "database"
+    label = "databases"
+    path = "/v2/databases"
+    key = "databases"
+
+    def record(self, db):
+        nodes = db.get("num_nodes", 1)
+        size = db.get("size", "unknown")
+        monthly = pricing.rates.get(size)
+        if monthly is None:
+            logger.warning(f"No price for database size {size}, set it in pricing overrides")
+            monthly = 0
+
+        return ResourceRecord(
+            resource_id=db.get("id"),
+            name=db.get("name", f"db-{db.get('id')}"),
+            resource_type="database",
+            region=region_of(db),
+            cost=monthly * nodes / 30,
+            disk_gb=db.get("storage_size_mib", 0) // 1024,
+            size=f"{db.get('engine', '')} {size} x{nodes}",
+        )
+
+
+@register
+class SnapshotCollector(ResourceCollector):
+    name = "snapshot"
+    label = "snapshots"
+    path = "/v2/snapshots"
+    key = "snapshots"
+
+    def record(self, snapshot):
+        size_gb = snapshot.get("size_gigabytes", 0)
+        regions = snapshot.get("regions") or ["unknown"]
+
+        return ResourceRecord(
+            resource_id=str(snapshot.get("id")),
+            name=snapshot.get("name", f"snapshot-{snapshot.get('id')}"),
+            resource_type="snapshot",
+            region=regions[0],
+            cost=size_gb * pricing.rates["snapshot_gb"] / 30,
+            disk_gb=size_gb,
+        )
+
+
+@register
+class ReservedIPCollector(ResourceCollector):
+    """Reserved IPs are only billed while not assigned to a droplet"""
+
+    name = "reserved_ip"
+    label = "reserved IPs"
+    path = "/v2/reserved_ips"
+    key = "reserved_ips"
+
+    def record(self, reserved_ip):
+        assigned = reserved_ip.get("droplet") is not None
+
+        return ResourceRecord(
+            resource_id=reserved_ip.get("ip"),
+            name=reserved_ip.get("ip"),
+            resource_type="reserved_ip",
+            region=region_of(reserved_ip),
+            cost=0 if assigned else pricing.rates["reserved_ip_unassigned"] / 30,
+            size="Reserved IP" if assigned else "Reserved IP (unassigned)",
+        )
+
+
+@register
+class SpacesCollector(Collector):
+    """Flat Spaces subscription fee
+
+    The DO API has no bucket inventory, so the subscription is reported as
+    soon as the account has Spaces access keys. Usage above the included
+    storage and transfer only shows up in the invoice.
+    """
+
+    name = "spaces"
+    label = "Spaces subscription"
+
+    async def collect(self, client):
+        keys = await client.get("/v2/spaces/keys", params={"per_page": 1})
+        if not keys.get("keys"):
+            return ()
+        return (ResourceRecord(
+            resource_id="spaces",
+            name="spaces",
+            resource_type="spaces",
+            region="global",
+            cost=pricing.rates["spaces_subscription"] / 30,
+            size="Spaces subscription",
+        ),)
+
+
+SOURCES = {name: collector for name, collector in COLLECTORS.items() if name in ENABLED_COLLECTORS}
+
+
+async def collect_metrics(client, snapshot, sources=SOURCES):
+    """Run the given sources concurrently and return the next snapshot
+
+    A cycle lasts as long as the slowest source. Sources that fail or miss
+    the CYCLE_TIMEOUT deadline keep their values from the previous snapshot.
+    Action-tracked sources not listed in this cycle are patched from the
+    actions feed when it was polled.
+    """
+    results = {}
+    account = client.account
+
+    async def run(name, collector, pending):
+        try:
+            with collector_duration.labels(account=account, source=name).time():
+                result = results[name] = await pending
+        except Exception as e:
+            collector_errors.labels(account=account, source=name).inc()
+            logger.error(f"{account}: Failed to fetch {collector.label}: {e}")
+            return
+        last_success.labels(account=account, source=name).set_to_current_time()
+        if name not in BILLING_SOURCES and name != "actions":
+            resources_processed.labels(account=account, resource_type=name).set(len(result))
+
+    def apply(collector, records, feed):
+        complete, actions = feed
+        if not complete:
+            logger.warning(f"{account}: Actions feed overflowed, listing all {collector.label}")
+            return collector.collect(client)
+        return collector.apply(client, records, actions)
+
     try:
-        lbs = requests.get(
-            "https://api.digitalocean.com/v2/load_balancers?per_page=200",
-            headers=headers
-        ).json()
-        
-        for lb in lbs.get("load_balancers", []):
-            lb_id = lb.get("id")
-            lb_name = lb.get("name", f"lb-{lb_id}")
-            region = lb.get("region", {}).get("slug", "unknown")
-            
-            cost = 12 / 30
-            
-            resource_cost.labels(
-                resource_id=lb_id,
-                resource_name=lb_name,
-                resource_type="loadbalancer",
-                specs="Load Balancer",
-                region=region
-            ).set(cost)
-            
-            total_cost += cost
-            logger.debug(f"Load Balancer {lb_name}: ${cost:.2f}/day")
-        
-        logger.info(f"Processed {len(lbs.get('load_balancers', []))} load balancers")
-        
-    except Exception as e:
-        logger.error(f"Failed to fetch load balancers: {e}")
-    
-    logger.info(f"Total daily cost: ${total_cost:.2f}")
+        with collection_duration.labels(account=account).time():
+            async with asyncio.timeout(CYCLE_TIMEOUT):
+                await pricing.refresh(client)
+                await asyncio.gather(*(run(name, collector, collector.collect(client)) for name, collector in sources.items()))
+                feed = results.pop("actions", None)
+                if feed is not None:
+                    await asyncio.gather(*(
+                        run(name, collector, apply(collector, snapshot.parts[name], feed))
+                        for name, collector in SOURCES.items()
+                        if getattr(collector, "action_type", None) and name not in sources and name in snapshot.parts
+                    ))
+    except TimeoutError:
+        logger.error(f"{account}: Collection cycle exceeded {CYCLE_TIMEOUT}s deadline, partial results kept")
 
-if __name__ == "__main__":
-    logger.info(f"Starting DigitalOcean cost exporter on port {METRICS_PORT} with poll interval {POLL_INTERVAL}s")
-    start_http_server(METRICS_PORT)
+    snapshot = snapshot.merge(results)
+    logger.info(f"{account}: Total daily cost: ${snapshot.total_cost():.2f}")
+    return snapshot
+
+
+async def run_scheduler(client, slots):
+    """Refresh each source of an account on its own interval
+
+    Sources falling due within COALESCE_WINDOW of each other are collected
+    in the same cycle, so tiers sharing an interval wake the loop once.
+    `slots` bounds how many accounts collect at the same time.
+    """
+    next_due = dict.fromkeys(SOURCES, 0.0)
     while True:
+        now = time.monotonic()
+        due = {name: SOURCES[name] for name, at in next_due.items() if at <= now + COALESCE_WINDOW}
+        for name, collector in due.items():
+            next_due[name] = now + collector.interval
+
+        logger.info(f"{client.account}: Collecting {', '.join(due)}")
         try:
-            collect_metrics()
+            async with slots:
+                snapshot = cost_collector.snapshots.get(client.account, Snapshot())
+                snapshot = await collect_metrics(client, snapshot, due)
+                if kube is not None:
+                    snapshot = kube.attribute(snapshot)
+                ledger.accrue(client.account, snapshot)
+                cost_collector.publish(client.account, snapshot)
+            await asyncio.to_thread(snapshot_store.save, client.account, snapshot)
+            await asyncio.to_thread(history.record, client.account, snapshot)
+            await asyncio.to_thread(ledger.save)
         except Exception as e:
-            logger.exception(f"Unexpected error during metrics collection: {e}")
-        time.sleep(POLL_INTERVAL)
+            logger.exception(f"{client.account}: Unexpected error during metrics collection: {e}")
+
+        await asyncio.sleep(max(0, min(next_due.values()) - time.monotonic()))
+
+
+def load_accounts():
+    """Map account names to API tokens
+
+    DO_ACCOUNTS lists the account names, each token is read from
+    DO_API_TOKEN_<NAME>. Without DO_ACCOUNTS, DO_API_TOKEN is the single
+    account "default".
+    """
+    if not DO_ACCOUNTS:
+        return {"default": DO_API_TOKEN} if DO_API_TOKEN else {}
+
+    accounts = {}
+    for account in DO_ACCOUNTS:
+        token = os.getenv(f"DO_API_TOKEN_{account.upper().replace('-', '_')}", "")
+        if token:
+            accounts[account] = token
+        else:
+            logger.warning(f"No token for account {account}, skipping it")
+    return accounts
+
+
+async def main():
+    logger.info(
+        f"Starting DigitalOcean cost exporter on port {METRICS_PORT} with billing interval "
+        f"{BILLING_INTERVAL}s and inventory interval {INVENTORY_INTERVAL}s"
+    )
+    start_http_server(METRICS_PORT)
+
+    accounts = load_accounts()
+    if not accounts:
+        logger.warning("DO_API_TOKEN not set - metrics will be 0")
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+
+    logger.info(f"Collecting accounts: {', '.join(accounts)}")
+    for account, snapshot in snapshot_store.load().items():
+        if account in accounts:
+            cost_collector.publish(account, snapshot)
+    slots = asyncio.Semaphore(ACCOUNT_CONCURRENCY)
+    # Cancel on SIGTERM so the ledger is checkpointed before the pod goes away
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    try:
+        async with create_session() as session:
+            async with asyncio.TaskGroup() as group:
+                if kube is not None:
+                    logger.info(f"Attributing costs to Kubernetes objects from {KUBE_API_URL}")
+                    group.create_task(kube.run())
+                    try:
+                        await asyncio.wait_for(kube.ready.wait(), REQUEST_TIMEOUT)
+                    except TimeoutError:
+                        logger.warning("Kubernetes cache not synced yet, first collections are not attributed")
+                for account, token in accounts.items():
+                    group.create_task(run_scheduler(DOClient(session, account, token), slots))
+    except asyncio.CancelledError:
+        logger.info("Shutting down")
+    finally:
+        ledger.save(force=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
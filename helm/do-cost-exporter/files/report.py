@@ -1,25 +1,299 @@
 #!/usr/bin/env python3
+"""Daily cost report sent to Discord and other sinks
+
+Report data comes from the first fresh source of REPORT_SOURCES:
+Prometheus, or the exporter's /metrics read directly when Prometheus is
+down or behind. Runs once by default (CronJob). With --serve it stays up as a sidecar: an
+in-process cron fires REPORT_SCHEDULE (UTC) and POST /report on
+REPORT_PORT triggers a run on demand. HTTP goes through urllib, so the
+report needs nothing beyond the standard library.
+
+Trends come from range queries over the last TREND_DAYS completed days,
+cached on disk per day, and are computed with NumPy when it is installed;
+without it the month-end estimate is a linear extrapolation of the MTD.
+
+The report is built once and delivered concurrently to every configured
+sink (Discord, Slack, a generic webhook, a JSON object in Spaces), each
+with bounded retries. Delivery outcomes are pushed to PUSHGATEWAY_URL
+and/or written to REPORT_METRICS_FILE.
+"""
 import os
 import re
-import requests
-from datetime import datetime, timedelta
-from discord_webhook import DiscordWebhook, DiscordEmbed
+import sys
+import json
+import time
+import hmac
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import NamedTuple
+from email.message import Message
+from urllib.error import HTTPError
+from urllib.parse import urlparse, parse_qs, quote, urlencode
+from urllib.request import Request, urlopen
 
 PROMETHEUS_URL = os.getenv("PROMETHEUS_URL", "http://prometheus:9090")
 DISCORD_WEBHOOK_URL = os.getenv("DISCORD_WEBHOOK", "")
+SLACK_WEBHOOK_URL = os.getenv("SLACK_WEBHOOK", "")
+REPORT_WEBHOOK_URL = os.getenv("REPORT_WEBHOOK_URL", "")
+SPACES_ENDPOINT = os.getenv("SPACES_ENDPOINT", "https://sgp1.digitaloceanspaces.com")
+SPACES_REGION = os.getenv("SPACES_REGION", "sgp1")
+SPACES_BUCKET = os.getenv("SPACES_BUCKET", "")
+SPACES_PREFIX = os.getenv("SPACES_PREFIX", "cost-reports/")
+SPACES_ACCESS_KEY_ID = os.getenv("SPACES_ACCESS_KEY_ID", "")
+SPACES_SECRET_ACCESS_KEY = os.getenv("SPACES_SECRET_ACCESS_KEY", "")
+DELIVERY_RETRIES = int(os.getenv("DELIVERY_RETRIES", "3"))
+DELIVERY_MAX_WAIT = float(os.getenv("DELIVERY_MAX_WAIT", "60"))
+PUSHGATEWAY_URL = os.getenv("PUSHGATEWAY_URL", "")
+REPORT_METRICS_FILE = os.getenv("REPORT_METRICS_FILE", "")
 COST_THRESHOLD = float(os.getenv("COST_THRESHOLD", "100"))
+QUERY_TIMEOUT = float(os.getenv("QUERY_TIMEOUT", "10"))
+QUERY_RETRIES = int(os.getenv("QUERY_RETRIES", "3"))
+REPORT_SCHEDULE = os.getenv("REPORT_SCHEDULE", "0 2 * * *")
+REPORT_PORT = int(os.getenv("REPORT_PORT", "8081"))
+EXPORTER_URL = os.getenv("EXPORTER_URL", "http://localhost:8080")
+REPORT_SOURCES = [name.strip() for name in os.getenv("REPORT_SOURCES", "prometheus,exporter").split(",") if name.strip()]
+REPORT_MAX_AGE = float(os.getenv("REPORT_MAX_AGE", "10800"))
+RECORDING_RULES = os.getenv("RECORDING_RULES", "false").lower() == "true"
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", "/tmp/cost-report")
+TREND_DAYS = int(os.getenv("TREND_DAYS", "35"))
+TREND_STEP = int(os.getenv("TREND_STEP", "3600"))
+TREND_FIT_DAYS = int(os.getenv("TREND_FIT_DAYS", "14"))
+TREND_AVERAGE_DAYS = int(os.getenv("TREND_AVERAGE_DAYS", "7"))
+
+DAY = 86400
+if DAY % TREND_STEP:
+    raise ValueError(f"TREND_STEP must divide a day, got {TREND_STEP}")
+SERVICE_RULES = os.getenv("SERVICE_RULES", os.path.join(os.path.dirname(os.path.abspath(__file__)), "service-rules.json"))
+
+METRIC_NAME = re.compile(r"[a-zA-Z_:][a-zA-Z0-9_:]*")
+
+# Aggregations the report reads, as (recorded series, expression). The
+# chart's PrometheusRule is generated from this table with
+# tools/gen_recording_rules.py; with RECORDING_RULES the report queries the
+# recorded series instead of evaluating the expressions on every run.
+AGGREGATES = {
+    "billing": ("do_cost:billing_mtd:sum_by_category", "sum by (category) (do_cost_exporter_billing_mtd)"),
+    "balance": ("do_cost:billing_balance:sum_by_type", "sum by (type) (do_cost_exporter_billing_balance)"),
+    "mtd": ("do_cost:month_to_date_usage:sum", 'sum(do_cost_exporter_billing_balance{type="month_to_date_usage"})'),
+    "rates": ("do_cost:resource_cost:sum_by_resource_type", "sum by (resource_type) (do_cost_exporter_resource_cost)"),
+}
+
+
+def aggregate(name):
+    record, expression = AGGREGATES[name]
+    return record if RECORDING_RULES else expression
+
+
+class Sample(NamedTuple):
+    """One series of an instant query result"""
+    labels: dict
+    value: float
+
+
+class Series(NamedTuple):
+    """One series of a range query result"""
+    labels: dict
+    points: list
+
 
-# Services to hide from report
-HIDDEN_SERVICES = ["loki (monitoring)", "grafana (monitoring)"]
+class Response(NamedTuple):
+    """Status, headers and body of an HTTP response"""
+    url: str
+    status_code: int
+    headers: Message
+    body: bytes
+
+    def json(self):
+        return json.loads(self.body)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise OSError(f"HTTP {self.status_code} from {self.url}")
+
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def retry_delay(response, attempt):
+    """Seconds to wait before retrying a response, from its rate limit headers when present"""
+    if response is not None:
+        for header in ("Retry-After", "X-RateLimit-Reset-After"):
+            try:
+                return float(response.headers.get(header))
+            except (TypeError, ValueError):
+                pass
+        try:
+            return float(response.json()["retry_after"])
+        except Exception:
+            pass
+    return 0.5 * 2 ** (attempt - 1)
+
+
+def open_url(method, url, params=None, data=None, headers=None, timeout=QUERY_TIMEOUT, retries=QUERY_RETRIES):
+    """Open a URL, retrying connection errors, 429 and 5xx with backoff
+
+    Returns the open http.client response. Other statuses, and the last
+    attempt's error, raise urllib's HTTPError or URLError.
+    """
+    if params:
+        url = f"{url}?{urlencode(params)}"
+    request = Request(url, data=data, headers=headers or {}, method=method)
+    for attempt in range(1, retries + 2):
+        try:
+            return urlopen(request, timeout=timeout)
+        except HTTPError as e:
+            if e.code not in RETRY_STATUSES or attempt > retries:
+                raise
+            with e:
+                delay = retry_delay(Response(url, e.code, e.headers, e.read()), attempt)
+        except OSError:
+            if attempt > retries:
+                raise
+            delay = retry_delay(None, attempt)
+        time.sleep(min(delay, QUERY_TIMEOUT))
+
+
+def http_request(method, url, params=None, data=None, headers=None, timeout=QUERY_TIMEOUT, retries=QUERY_RETRIES):
+    """Send a request with open_url and read the whole Response, error statuses included"""
+    try:
+        with open_url(method, url, params, data, headers, timeout, retries) as response:
+            return Response(url, response.status, response.headers, response.read())
+    except HTTPError as e:
+        with e:
+            return Response(url, e.code, e.headers, e.read())
 
 
 def query_prometheus(query):
-    """Query Prometheus and return results"""
-    response = requests.get(f"{PROMETHEUS_URL}/api/v1/query", params={"query": query})
+    """Run an instant query and return its samples"""
+    response = http_request(
+        "GET", f"{PROMETHEUS_URL}/api/v1/query",
+        params={"query": query, "timeout": f"{QUERY_TIMEOUT:g}s"},
+        timeout=QUERY_TIMEOUT + 5,
+    )
+    response.raise_for_status()
     data = response.json()
     if data["status"] != "success":
+        print(f"Query failed: {query}: {data.get('error')}")
         return []
-    return data["data"]["result"]
+    return [Sample(result["metric"], float(result["value"][1])) for result in data["data"]["result"]]
+
+
+def query_many(queries):
+    """Run named instant queries concurrently, returns {name: [Sample]}
+
+    Queries that are plain metric names are combined into a single
+    {__name__=~"..."} request and split back by metric name.
+    """
+    selectors = {name: query for name, query in queries.items() if METRIC_NAME.fullmatch(query)}
+    pending = {name: query for name, query in queries.items() if name not in selectors}
+    if len(selectors) > 1:
+        pending[None] = '{__name__=~"%s"}' % "|".join(sorted(set(selectors.values())))
+    else:
+        pending.update(selectors)
+    
+    with ThreadPoolExecutor(max_workers=len(pending)) as pool:
+        futures = {name: pool.submit(query_prometheus, query) for name, query in pending.items()}
+        results = {name: future.result() for name, future in futures.items()}
+    
+    combined = results.pop(None, None)
+    if combined is not None:
+        for name, metric in selectors.items():
+            results[name] = [sample for sample in combined if sample.labels.get("__name__") == metric]
+    return results
+
+
+def query_range(query, start, end, step):
+    """Run a range query and return its series, raises when Prometheus reports an error"""
+    response = http_request(
+        "GET", f"{PROMETHEUS_URL}/api/v1/query_range",
+        params={"query": query, "start": start, "end": end, "step": step, "timeout": f"{QUERY_TIMEOUT:g}s"},
+        timeout=QUERY_TIMEOUT + 5,
+    )
+    response.raise_for_status()
+    data = response.json()
+    if data["status"] != "success":
+        raise ValueError(f"Range query failed: {query}: {data.get('error')}")
+    return [
+        Series(result["metric"], [(float(t), float(v)) for t, v in result["values"]])
+        for result in data["data"]["result"]
+    ]
+
+
+class RangeCache:
+    """Range query results cached on disk per (query, step) and UTC day
+
+    A completed day never changes, so it is fetched once: a run only queries
+    the days missing from the cache, consecutive ones in a single request.
+    Days without samples (Prometheus down, a recording rule added since) are
+    not cached, so later runs query them again.
+    Each day holds DAY // step samples per series, taken a minute before the
+    end of each step so the last one still sees the day's closing values.
+    """
+
+    OFFSET = 60
+
+    def __init__(self, directory, step):
+        self.directory = directory
+        self.step = step
+        self.per_day = DAY // step
+
+    def path(self, query):
+        digest = hashlib.blake2b(f"{query}\0{self.step}".encode(), digest_size=12).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def load(self, query):
+        try:
+            with open(self.path(query)) as f:
+                return json.load(f)["days"]
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def save(self, query, days):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(query)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump({"query": query, "step": self.step, "days": days}, f)
+        os.replace(f"{path}.tmp", path)
+
+    def sample_time(self, day, index):
+        midnight = datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp()
+        return midnight + (index + 1) * self.step - self.OFFSET
+
+    def split(self, series, days):
+        """Spread range query series over {day: {labels: [value or None]}}"""
+        chunks = {day.isoformat(): {} for day in days}
+        for s in series:
+            key = json.dumps(s.labels, sort_keys=True)
+            for t, value in s.points:
+                moment = datetime.fromtimestamp(t + self.OFFSET - 1, timezone.utc)
+                chunk = chunks.get(moment.date().isoformat())
+                if chunk is not None:
+                    values = chunk.setdefault(key, [None] * self.per_day)
+                    values[(moment.hour * 3600 + moment.minute * 60 + moment.second) // self.step] = value
+        return chunks
+
+    def fetch(self, query, days):
+        """Day chunks for completed `days` (dates, ascending), querying only the uncached ones"""
+        cached = self.load(query)
+        missing = [day for day in days if day.isoformat() not in cached]
+        runs = []
+        for day in missing:
+            if runs and (day - runs[-1][-1]).days == 1:
+                runs[-1].append(day)
+            else:
+                runs.append([day])
+        for run in runs:
+            series = query_range(query, self.sample_time(run[0], 0), self.sample_time(run[-1], self.per_day - 1), self.step)
+            cached.update(self.split(series, run))
+        
+        window = {day.isoformat() for day in days}
+        if missing or set(cached) - window:
+            self.save(query, {day: chunk for day, chunk in cached.items() if chunk and day in window})
+        print(f"Range query over {len(days)} days: {len(days) - len(missing)} cached, {len(runs)} requests")
+        return [cached[day.isoformat()] for day in days]
 
 
 def get_billing_period():
@@ -39,85 +313,445 @@ def get_billing_period():
     }
 
 
-def get_pvc_service_map():
-    """Build a map from PV name to service name"""
-    results = query_prometheus("kube_persistentvolumeclaim_info")
-    pvc_map = {}
-    
-    for result in results:
-        labels = result["metric"]
-        pv_name = labels.get("volumename", "")
-        pvc_name = labels.get("persistentvolumeclaim", "")
-        namespace = labels.get("namespace", "")
-        
-        if not pv_name:
+def report_queries():
+    """Queries the report needs, by name"""
+    queries = {
+        "resources": "do_cost_exporter_resource_cost",
+        "pvcs": "do_cost_exporter_pvc_cost",
+        "billing": aggregate("billing"),
+        "balance": aggregate("balance"),
+        "age": "max(time() - do_cost_exporter_snapshot_timestamp_seconds)",
+    }
+    now = datetime.now()
+    seconds = int((now - now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)).total_seconds())
+    if seconds >= 60:
+        queries["accrued"] = (
+            f"sum by (resource_type) (increase(do_cost_exporter_resource_type_cost_dollars_total[{seconds}s]))"
+        )
+    return queries
+
+
+LABEL = re.compile(r'\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*=\s*"((?:[^"\\]|\\.)*)"\s*,?')
+ESCAPE = re.compile(r"\\(.)")
+
+
+def parse_exposition(lines, names):
+    """Incrementally parse Prometheus text format, yielding (name, labels, value)
+
+    Only samples of metric `names` are parsed further than their name, so
+    unrelated families cost one lookup per line.
+    """
+    for line in lines:
+        if not line or line[0] == "#":
             continue
-        
-        if pvc_name.startswith("database-") or "keycloak-db" in pvc_name:
-            service = f"postgresql ({namespace})"
-        elif "redis" in pvc_name:
-            service = f"redis ({namespace})"
-        elif "queue" in pvc_name:
-            service = f"rabbitmq ({namespace})"
-        elif "grafana" in pvc_name:
-            service = "grafana (monitoring)"
-        elif "prometheus" in pvc_name:
-            service = "prometheus (monitoring)"
-        elif "alertmanager" in pvc_name:
-            service = "alertmanager (monitoring)"
-        elif "loki" in pvc_name:
-            service = "loki (monitoring)"
+        brace = line.find("{")
+        space = line.find(" ")
+        if brace != -1 and (space == -1 or brace < space):
+            name = line[:brace]
         else:
-            service = f"{pvc_name} ({namespace})"
+            name = line[:space]
+        if name not in names:
+            continue
         
-        pvc_map[pv_name] = service
-    
-    return pvc_map
+        labels = {}
+        end = space
+        if brace != -1 and (space == -1 or brace < space):
+            position = brace + 1
+            while line[position] != "}":
+                match = LABEL.match(line, position)
+                if match is None:
+                    raise ValueError(f"malformed labels: {line!r}")
+                value = match.group(2)
+                if "\\" in value:
+                    value = ESCAPE.sub(lambda m: "\n" if m.group(1) == "n" else m.group(1), value)
+                labels[match.group(1)] = value
+                position = match.end()
+                while line[position] == " ":
+                    position += 1
+            end = position + 1
+        yield name, labels, float(line[end:].split()[0])
 
 
-def get_costs():
-    """Query Prometheus for cost metrics (current resources, daily rate)"""
-    results = query_prometheus("do_cost_exporter_resource_cost")
-    
+def sum_by(samples, label):
+    totals = {}
+    for sample in samples:
+        key = sample.labels.get(label, "unknown")
+        totals[key] = totals.get(key, 0) + sample.value
+    return [Sample({label: key}, value) for key, value in totals.items()]
+
+
+class PrometheusSource:
+    """Report data from PromQL queries"""
+
+    name = "prometheus"
+
+    def fetch(self):
+        return query_many(report_queries())
+
+
+class ExporterSource:
+    """Report data read straight from the exporter's /metrics
+
+    The exposition is streamed and parsed line by line, and the sums the
+    PromQL queries would do are done here. Accrued MTD needs a counter
+    increase over the month, so it is left out.
+    """
+
+    name = "exporter"
+    METRICS = {
+        "do_cost_exporter_resource_cost": "resources",
+        "do_cost_exporter_pvc_cost": "pvcs",
+        "do_cost_exporter_billing_mtd": "billing",
+        "do_cost_exporter_billing_balance": "balance",
+        "do_cost_exporter_snapshot_timestamp_seconds": "timestamps",
+    }
+
+    def fetch(self):
+        samples = {name: [] for name in self.METRICS.values()}
+        with open_url("GET", f"{EXPORTER_URL}/metrics") as response:
+            lines = (line.decode().rstrip("\r\n") for line in response)
+            for name, labels, value in parse_exposition(lines, self.METRICS):
+                samples[self.METRICS[name]].append(Sample(labels, value))
+        
+        timestamps = samples.pop("timestamps")
+        samples["billing"] = sum_by(samples["billing"], "category")
+        samples["balance"] = sum_by(samples["balance"], "type")
+        samples["age"] = [Sample({}, time.time() - min(s.value for s in timestamps))] if timestamps else []
+        return samples
+
+
+SOURCES = {source.name: source for source in (PrometheusSource(), ExporterSource())}
+
+
+def stale_reason(results):
+    """Why a source's data cannot be used for the report, None when it can"""
+    if not any(s.labels.get("type") == "month_to_date_usage" and s.value for s in results["balance"]):
+        return "no billing data"
+    if results["age"] and results["age"][0].value > REPORT_MAX_AGE:
+        return f"data is {results['age'][0].value:.0f}s old"
+    return None
+
+
+def fetch_report_data():
+    """Data of the first usable source in REPORT_SOURCES, returns (source name, results)"""
+    for name in REPORT_SOURCES:
+        try:
+            results = SOURCES[name].fetch()
+        except Exception as e:
+            print(f"Source {name} failed: {e}")
+            continue
+        reason = stale_reason(results)
+        if reason is None:
+            return name, results
+        print(f"Source {name} skipped: {reason}")
+    return None, None
+
+
+class Classification(NamedTuple):
+    """Service a volume is reported under"""
+    service: str
+    hidden: bool
+
+
+UNCLASSIFIED = Classification("unknown", False)
+
+
+class ServiceRules:
+    """PVC to service classification compiled from rules
+
+    A volume is reported under "<app or claim> (<namespace>)" unless a rule
+    matches it: by `prefix` or `regex` from the start of "namespace/claim",
+    or by `label` equal to `value` (optionally only in `namespace`). The
+    first matching rule sets its `service` and `hidden`. Prefix and regex
+    rules are compiled into one alternation whose first matching branch is
+    the earliest rule, label rules into an index by (label, value). Regexes
+    that cannot be embedded in the alternation (inline global flags, group
+    references, named groups) are matched on their own. Invalid rules are
+    reported and skipped. Classifications are cached by PersistentVolume, so
+    a run only evaluates the rules for volumes it has not seen.
+    """
+
+    STANDALONE = re.compile(r"^\(\?[aiLmsux]+\)|\\[1-9]|\(\?P[<=]|\(\?\(")
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.labels = {}
+        self.standalone = []
+        branches = []
+        for i, rule in enumerate(rules):
+            if "prefix" in rule:
+                branches.append((i, re.escape(str(rule["prefix"]))))
+            elif "regex" in rule:
+                try:
+                    pattern = re.compile(rule["regex"])
+                except (re.error, TypeError) as e:
+                    print(f"Skipping service rule {i}, invalid regex {rule['regex']!r}: {e}")
+                    continue
+                if self.STANDALONE.search(rule["regex"]):
+                    self.standalone.append((i, pattern))
+                else:
+                    branches.append((i, rule["regex"]))
+            elif "label" in rule and "value" in rule:
+                self.labels.setdefault((rule["label"], str(rule["value"])), []).append(i)
+            else:
+                print(f"Skipping service rule {i}, it needs a prefix, regex or label and value: {rule}")
+        try:
+            self.pattern = re.compile("|".join(f"(?P<r{i}>{branch})" for i, branch in branches)) if branches else None
+        except re.error as e:
+            # Valid on their own but not together, fall back to one by one
+            print(f"Matching service rules one by one, they do not combine: {e}")
+            self.pattern = None
+            self.standalone = sorted(self.standalone + [(i, re.compile(branch)) for i, branch in branches])
+        self.cache = {}
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path) as f:
+                rules = json.load(f)
+        except FileNotFoundError:
+            return cls([])
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable service rules {path}: {e}")
+            return cls([])
+        return cls(rules)
+
+    def evaluate(self, labels):
+        namespace = labels.get("namespace", "")
+        claim = labels.get("persistentvolumeclaim", "")
+        path = f"{namespace}/{claim}"
+        matched = []
+        if self.pattern:
+            match = self.pattern.match(path)
+            if match:
+                matched.append(int(match.lastgroup[1:]))
+        for i, pattern in self.standalone:
+            if matched and i > matched[0]:
+                break
+            if pattern.match(path):
+                matched.append(i)
+                break
+        for label, value in labels.items():
+            for i in self.labels.get((label, value), ()):
+                if self.rules[i].get("namespace", namespace) == namespace:
+                    matched.append(i)
+                    break
+
+        service = f"{labels.get('app') or claim or 'unknown'} ({namespace})"
+        if not matched:
+            return Classification(service, False)
+        rule = self.rules[min(matched)]
+        return Classification(rule.get("service", service), bool(rule.get("hidden", False)))
+
+    def classify(self, samples):
+        """Map volume IDs to their Classification, evaluating only uncached volumes"""
+        cache, self.cache = self.cache, {}
+        classified = {}
+        for sample in samples:
+            labels = sample.labels
+            key = labels.get("persistentvolume") or labels.get("resource_id", "")
+            result = cache.get(key) or self.evaluate(labels)
+            self.cache[key] = classified[labels.get("resource_id", "")] = result
+        return classified
+
+
+service_rules = ServiceRules.load(SERVICE_RULES)
+
+
+def get_pvc_service_map(samples):
+    """Build a map from volume ID to its service
+
+    The exporter joins volumes to their PersistentVolumeClaim, the rules
+    decide which service each claim is reported under.
+    """
+    return service_rules.classify(samples)
+
+
+def get_costs(samples):
+    """Current resources with their daily rate"""
     resources = []
-    for result in results:
-        labels = result["metric"]
-        value = float(result["value"][1])
+    for sample in samples:
+        labels = sample.labels
         resources.append({
+            "id": labels.get("resource_id", ""),
             "name": labels.get("resource_name", "unknown"),
             "type": labels.get("resource_type", "unknown"),
             "specs": labels.get("specs", ""),
-            "cost": value
+            "cost": sample.value
         })
     
     return sorted(resources, key=lambda x: x["cost"], reverse=True)
 
 
-def get_billing():
-    """Query Prometheus for actual DO billing data"""
+def get_billing(billing_samples, balance_samples):
+    """Actual DO billing data"""
     billing = {"droplets": 0, "volumes": 0, "load balancers": 0, "taxes": 0, "credits": 0, "total": 0}
     
-    results = query_prometheus("do_cost_exporter_billing_mtd")
-    for result in results:
-        category = result["metric"].get("category", "unknown")
-        value = float(result["value"][1])
-        billing[category] = value
+    for sample in billing_samples:
+        billing[sample.labels.get("category", "unknown")] = sample.value
     
-    balance_results = query_prometheus("do_cost_exporter_billing_balance")
-    for result in balance_results:
-        billing_type = result["metric"].get("type", "unknown")
-        value = float(result["value"][1])
-        billing[billing_type] = value
+    for sample in balance_samples:
+        billing[sample.labels.get("type", "unknown")] = sample.value
     
     return billing
 
 
+def get_accrued_mtd(samples):
+    """Month-to-date cost per resource type from the accrued cost counters"""
+    return {sample.labels.get("resource_type", "unknown"): sample.value for sample in samples}
+
+
+def trend_queries():
+    """Range queries the trends need, by name"""
+    return {
+        "mtd": aggregate("mtd"),
+        "rates": aggregate("rates"),
+    }
+
+
+def load_trends(today):
+    """Day chunks of the trend queries over the completed days before `today`
+
+    Returns None when NumPy is missing or Prometheus fails, the report then
+    falls back to a linear estimate.
+    """
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        print("NumPy not installed, trends disabled")
+        return None
+    
+    days = [today - timedelta(days=n) for n in range(TREND_DAYS, 0, -1)]
+    cache = RangeCache(REPORT_CACHE_DIR, TREND_STEP)
+    try:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            futures = {name: pool.submit(cache.fetch, query, days) for name, query in trend_queries().items()}
+            return {"days": days, **{name: future.result() for name, future in futures.items()}}
+    except Exception as e:
+        print(f"Trend queries failed: {e}")
+        return None
+
+
+def series_matrix(chunks):
+    """Stack day chunks into (labels, array of shape (series, days, samples per day)), NaN where missing"""
+    import numpy as np
+
+    keys = sorted({key for chunk in chunks for key in chunk})
+    index = {key: i for i, key in enumerate(keys)}
+    per_day = DAY // TREND_STEP
+    matrix = np.full((len(keys), len(chunks), per_day), np.nan)
+    for d, chunk in enumerate(chunks):
+        for key, values in chunk.items():
+            matrix[index[key], d] = np.array(values, dtype=float)
+    return [json.loads(key) for key in keys], matrix
+
+
+def daily_last(matrix):
+    """Last sample of each day, shape (series, days)"""
+    import numpy as np
+
+    valid = ~np.isnan(matrix)
+    last = matrix.shape[2] - 1 - np.argmax(valid[:, :, ::-1], axis=2)
+    values = np.take_along_axis(matrix, last[..., None], axis=2)[..., 0]
+    return np.where(valid.any(axis=2), values, np.nan)
+
+
+def daily_mean(matrix):
+    """Mean of each day's samples, shape (series, days)"""
+    import numpy as np
+
+    valid = ~np.isnan(matrix)
+    counts = valid.sum(axis=2)
+    sums = np.where(valid, matrix, 0).sum(axis=2)
+    return np.divide(sums, counts, out=np.full(sums.shape, np.nan), where=counts > 0)
+
+
+def moving_average(daily, window):
+    """Trailing mean over `window` days, skipping missing days"""
+    import numpy as np
+
+    valid = ~np.isnan(daily)
+    zeros = np.zeros((daily.shape[0], 1))
+    sums = np.concatenate([zeros, np.cumsum(np.where(valid, daily, 0), axis=1)], axis=1)
+    counts = np.concatenate([zeros, np.cumsum(valid, axis=1)], axis=1)
+    end = np.arange(1, daily.shape[1] + 1)
+    start = np.maximum(end - window, 0)
+    window_sums = sums[:, end] - sums[:, start]
+    window_counts = counts[:, end] - counts[:, start]
+    return np.divide(window_sums, window_counts, out=np.full(daily.shape, np.nan), where=window_counts > 0)
+
+
+def linear_fit(daily):
+    """Least-squares line of each series over its days, skipping missing ones
+
+    Returns (intercept, slope, points) per series, x being the day index.
+    """
+    import numpy as np
+
+    x = np.arange(daily.shape[1], dtype=float)
+    valid = ~np.isnan(daily)
+    y = np.where(valid, daily, 0)
+    n = valid.sum(axis=1)
+    sx, sxx = (valid * x).sum(axis=1), (valid * x * x).sum(axis=1)
+    sy, sxy = y.sum(axis=1), (y * x).sum(axis=1)
+    denominator = n * sxx - sx * sx
+    slope = np.divide(n * sxy - sx * sy, denominator, out=np.zeros(n.shape), where=denominator != 0)
+    intercept = np.divide(sy - slope * sx, n, out=np.full(n.shape, np.nan), where=n > 0)
+    return intercept, slope, n
+
+
+def compute_trends(data, now, mtd_usage):
+    """Month-end forecast and per resource type daily trends
+
+    Daily spend is the day-over-day change of the month-to-date usage at
+    each day's close (its value on the 1st). A least-squares line over the
+    last TREND_FIT_DAYS days of spend projects the rest of the month on top
+    of the current MTD.
+    """
+    import numpy as np
+
+    days = data["days"]
+    _, mtd_matrix = series_matrix(data["mtd"])
+    forecast = None
+    if len(mtd_matrix):
+        mtd = daily_last(mtd_matrix)
+        first = np.array([day.day == 1 for day in days])
+        previous = np.concatenate([np.full((len(mtd), 1), np.nan), mtd[:, :-1]], axis=1)
+        spend = np.where(first, mtd, mtd - previous)
+        intercept, slope, points = linear_fit(spend[:, -TREND_FIT_DAYS:])
+        
+        period = get_billing_period()
+        fit_days = min(TREND_FIT_DAYS, len(days))
+        future = fit_days + np.arange(period["days_in_month"] - now.day + 1)
+        predicted = np.clip(intercept[:, None] + slope[:, None] * future, 0, None)
+        elapsed = (now.hour * 3600 + now.minute * 60 + now.second) / DAY
+        predicted[:, 0] *= 1 - elapsed
+        if (points >= 3).all():
+            forecast = mtd_usage + float(predicted.sum())
+    
+    labels, rate_matrix = series_matrix(data["rates"])
+    types = {}
+    if len(rate_matrix):
+        rates = daily_mean(rate_matrix)
+        averages = moving_average(rates, TREND_AVERAGE_DAYS)
+        deltas = np.diff(rates[:, -2:], axis=1)[:, 0] if rates.shape[1] > 1 else np.full(len(rates), np.nan)
+        for series, rate, delta, average in zip(labels, rates[:, -1], deltas, averages[:, -1]):
+            if not np.isnan(rate):
+                types[series.get("resource_type", "unknown")] = {
+                    "rate": float(rate),
+                    "delta": None if np.isnan(delta) else float(delta),
+                    "average": float(average),
+                }
+    
+    return {"forecast": forecast, "types": types}
+
+
 def group_volumes_by_service(volumes, pvc_map):
     """Group volumes by service and sum their costs"""
     grouped = {}
     for vol in volumes:
-        service = pvc_map.get(vol["name"], "unknown")
-        if service in HIDDEN_SERVICES:
+        service, hidden = pvc_map.get(vol["id"], UNCLASSIFIED)
+        if hidden:
             continue
         if service not in grouped:
             grouped[service] = {"name": service, "cost": 0, "count": 0, "size_gb": 0}
@@ -130,8 +764,18 @@ def group_volumes_by_service(volumes, pvc_map):
     return sorted(grouped.values(), key=lambda x: x["cost"], reverse=True)
 
 
-def build_embed(resources, billing):
-    """Build Discord embed from resources and actual billing data"""
+class Embed(dict):
+    """Report message in Discord embed form, which each sink converts to its own"""
+
+    def __init__(self, title, color):
+        super().__init__(title=title, color=color, fields=[])
+
+    def add_embed_field(self, name, value, inline=True):
+        self["fields"].append({"name": name, "value": value, "inline": inline})
+
+
+def build_embed(resources, billing, pvc_map, accrued, trends=None):
+    """Build the report embed from resources and actual billing data"""
     period = get_billing_period()
     days = period["days_elapsed"]
     days_in_month = period["days_in_month"]
@@ -144,9 +788,11 @@ def build_embed(resources, billing):
     taxes = billing.get("taxes", 0)
     credits = billing.get("credits", 0)
     
-    # Calculate daily rate and estimates from actual MTD
+    # Calculate daily rate and estimates from actual MTD, forecast from trends when available
     daily_rate = mtd_usage / days if days > 0 else 0
     estimated = daily_rate * days_in_month
+    if trends and trends["forecast"] is not None:
+        estimated = trends["forecast"]
     
     # Determine severity
     severity = "warning" if estimated > COST_THRESHOLD else "normal"
@@ -154,7 +800,7 @@ def build_embed(resources, billing):
     
     # Create embed
     title = f"Cost Report ({period['start']} - {period['today']})"
-    embed = DiscordEmbed(title=title, color=color)
+    embed = Embed(title=title, color=color)
     
     # Summary fields (3 columns at top) - using actual billing
     embed.add_embed_field(name="💳 Daily Rate", value=f"${daily_rate:.2f}", inline=True)
@@ -169,7 +815,6 @@ def build_embed(resources, billing):
     
     # Volumes - show actual MTD cost with service breakdown
     volumes = [r for r in resources if r["type"] == "volume"]
-    pvc_map = get_pvc_service_map()
     grouped_volumes = group_volumes_by_service(volumes, pvc_map)
     if grouped_volumes:
         volume_lines = []
@@ -184,6 +829,30 @@ def build_embed(resources, billing):
         lb_count = len(lbs) if lbs else "?"
         embed.add_embed_field(name=f"Load Balancers (${lb_mtd:.2f})", value=f"• {lb_count} LB", inline=False)
     
+    # Other resource types (DOKS, databases, snapshots, reserved IPs, Spaces) - current daily rate
+    others = {}
+    for r in resources:
+        if r["type"] not in ("droplet", "volume", "loadbalancer"):
+            others.setdefault(r["type"], []).append(r)
+    if others:
+        other_lines = []
+        for rtype, items in sorted(others.items()):
+            line = f"• {rtype}: {len(items)} (${sum(i['cost'] for i in items):.2f}/day"
+            if rtype in accrued:
+                line += f", ${accrued[rtype]:.2f} MTD"
+            other_lines.append(line + ")")
+        embed.add_embed_field(name="Other Resources", value="\n".join(other_lines), inline=False)
+    
+    # Daily rate per resource type over the completed days
+    if trends and trends["types"]:
+        trend_lines = []
+        for rtype, trend in sorted(trends["types"].items(), key=lambda x: x[1]["rate"], reverse=True):
+            line = f"• {rtype}: ${trend['rate']:.2f}/day, {TREND_AVERAGE_DAYS}d avg ${trend['average']:.2f}"
+            if trend["delta"] is not None:
+                line += f" ({trend['delta']:+.2f} vs previous day)"
+            trend_lines.append(line)
+        embed.add_embed_field(name="Trends", value="\n".join(trend_lines), inline=False)
+    
     # Taxes and Credits
     if taxes > 0 or credits != 0:
         extras = []
@@ -196,37 +865,361 @@ def build_embed(resources, billing):
     return embed, severity
 
 
-def send_to_discord(embed):
-    """Send embed to Discord webhook"""
-    if not DISCORD_WEBHOOK_URL:
-        print("No Discord webhook configured")
-        return
-    
-    webhook = DiscordWebhook(url=DISCORD_WEBHOOK_URL)
-    webhook.add_embed(embed)
+class Sink:
+    """Destination of the report
+
+    `request` turns the report ({"embed", "summary"}) into the HTTP request
+    to send; it is called again on every attempt.
+    """
+
+    name = "webhook"
+
+    def __init__(self, url):
+        self.url = url
+
+    def payload(self, report):
+        return report
+
+    def request(self, report):
+        """(method, url, headers, body) of one delivery attempt"""
+        return "POST", self.url, {"Content-Type": "application/json"}, json.dumps(self.payload(report)).encode()
+
+
+class DiscordSink(Sink):
+    name = "discord"
+
+    def payload(self, report):
+        return {"embeds": [report["embed"]]}
+
+
+class SlackSink(Sink):
+    name = "slack"
+
+    def payload(self, report):
+        embed = report["embed"]
+        return {
+            "text": embed["title"],
+            "attachments": [{
+                "color": f"#{embed['color']:06x}",
+                "title": embed["title"],
+                "fields": [{"title": f["name"], "value": f["value"], "short": f["inline"]} for f in embed["fields"]],
+            }],
+        }
+
+
+def sign_v4(method, url, headers, body, access_key, secret_key, region, service="s3", now=None):
+    """Headers signed with AWS Signature Version 4, for S3-compatible APIs
+
+    The path of `url` must already be URI-encoded.
+    """
+    parsed = urlparse(url)
+    now = now or datetime.now(timezone.utc)
+    date = now.strftime("%Y%m%d")
+    payload_hash = hashlib.sha256(body).hexdigest()
+    headers = {
+        **{k.lower(): v.strip() for k, v in headers.items()},
+        "host": parsed.netloc,
+        "x-amz-content-sha256": payload_hash,
+        "x-amz-date": now.strftime("%Y%m%dT%H%M%SZ"),
+    }
+    names = sorted(headers)
+    signed = ";".join(names)
+    query = "&".join(sorted(f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in
+                            (pair.partition("=")[::2] for pair in parsed.query.split("&") if pair)))
+    canonical = "\n".join([
+        method, parsed.path or "/", query,
+        *(f"{name}:{headers[name]}" for name in names), "", signed, payload_hash,
+    ])
+    scope = f"{date}/{region}/{service}/aws4_request"
+    to_sign = "\n".join(["AWS4-HMAC-SHA256", headers["x-amz-date"], scope, hashlib.sha256(canonical.encode()).hexdigest()])
+    key = f"AWS4{secret_key}".encode()
+    for part in (date, region, service, "aws4_request"):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    signature = hmac.new(key, to_sign.encode(), hashlib.sha256).hexdigest()
+    headers["authorization"] = (
+        f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, SignedHeaders={signed}, Signature={signature}"
+    )
+    del headers["host"]
+    return headers
+
+
+class SpacesSink(Sink):
+    """Report JSON stored as <prefix><date>.json in a Spaces (S3) bucket"""
+
+    name = "spaces"
+
+    def request(self, report):
+        key = quote(f"{SPACES_PREFIX}{datetime.now(timezone.utc):%Y-%m-%d}.json", safe="/-_.~")
+        url = f"{SPACES_ENDPOINT.rstrip('/')}/{SPACES_BUCKET}/{key}"
+        body = json.dumps(report).encode()
+        headers = sign_v4("PUT", url, {"Content-Type": "application/json"}, body,
+                          SPACES_ACCESS_KEY_ID, SPACES_SECRET_ACCESS_KEY, SPACES_REGION)
+        return "PUT", url, headers, body
+
+
+def configured_sinks():
+    sinks = []
+    if DISCORD_WEBHOOK_URL:
+        sinks.append(DiscordSink(DISCORD_WEBHOOK_URL))
+    if SLACK_WEBHOOK_URL:
+        sinks.append(SlackSink(SLACK_WEBHOOK_URL))
+    if REPORT_WEBHOOK_URL:
+        sinks.append(Sink(REPORT_WEBHOOK_URL))
+    if SPACES_BUCKET:
+        sinks.append(SpacesSink(SPACES_ENDPOINT))
+    return sinks
+
+
+def deliver(sink, report):
+    """Send the report to one sink, retrying connection errors, 429 and 5xx
+
+    Returns a dict with the outcome, the number of attempts and the seconds
+    spent. 4xx other than 429 fail right away.
+    """
+    start = time.monotonic()
+    for attempt in range(1, DELIVERY_RETRIES + 2):
+        method, url, headers, body = sink.request(report)
+        response = None
+        try:
+            response = http_request(method, url, data=body, headers=headers, retries=0)
+            detail = f"HTTP {response.status_code}"
+            if response.status_code < 300:
+                return {"sink": sink.name, "ok": True, "attempts": attempt, "seconds": time.monotonic() - start, "detail": detail}
+            if response.status_code != 429 and response.status_code < 500:
+                break
+        except Exception as e:
+            detail = str(e)
+        if attempt <= DELIVERY_RETRIES:
+            delay = min(retry_delay(response, attempt), DELIVERY_MAX_WAIT)
+            print(f"Delivery to {sink.name} failed ({detail}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+    return {"sink": sink.name, "ok": False, "attempts": attempt, "seconds": time.monotonic() - start, "detail": detail}
+
+
+def delivery_metrics(deliveries):
+    """Prometheus text exposition of the delivery outcomes"""
+    families = (
+        ("cost_report_delivery_success", "Whether the last delivery to the sink succeeded", lambda d: int(d["ok"])),
+        ("cost_report_delivery_attempts", "Attempts of the last delivery to the sink", lambda d: d["attempts"]),
+        ("cost_report_delivery_duration_seconds", "Duration of the last delivery to the sink, retries included",
+         lambda d: round(d["seconds"], 3)),
+    )
+    lines = []
+    for name, help_text, value in families:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        lines += [f'{name}{{sink="{d["sink"]}"}} {value(d)}' for d in deliveries]
+    lines += [
+        "# HELP cost_report_last_run_timestamp_seconds Unix time of the last report delivery",
+        "# TYPE cost_report_last_run_timestamp_seconds gauge",
+        f"cost_report_last_run_timestamp_seconds {time.time():.0f}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def record_deliveries(deliveries):
+    """Push the delivery metrics to the Pushgateway and/or write them to the textfile"""
+    text = delivery_metrics(deliveries)
+    if PUSHGATEWAY_URL:
+        try:
+            http_request("PUT", f"{PUSHGATEWAY_URL.rstrip('/')}/metrics/job/cost_report", data=text.encode(),
+                         retries=0).raise_for_status()
+        except Exception as e:
+            print(f"Failed to push delivery metrics: {e}")
+    if REPORT_METRICS_FILE:
+        try:
+            with open(f"{REPORT_METRICS_FILE}.tmp", "w") as f:
+                f.write(text)
+            os.replace(f"{REPORT_METRICS_FILE}.tmp", REPORT_METRICS_FILE)
+        except OSError as e:
+            print(f"Failed to write delivery metrics: {e}")
+
+
+def send_report(report):
+    """Deliver the report to all configured sinks concurrently, returns their outcomes"""
+    sinks = configured_sinks()
+    if not sinks:
+        print("No report sinks configured")
+        return []
     
-    response = webhook.execute()
-    if response.status_code in [200, 204]:
-        print("Message sent successfully")
-    else:
-        print(f"Failed to send: {response.status_code}")
+    with ThreadPoolExecutor(max_workers=len(sinks)) as pool:
+        deliveries = list(pool.map(lambda sink: deliver(sink, report), sinks))
+    for d in deliveries:
+        print(f"Delivery to {d['sink']}: {'ok' if d['ok'] else 'failed'} ({d['detail']}, "
+              f"{d['attempts']} attempts, {d['seconds']:.2f}s)")
+    record_deliveries(deliveries)
+    return deliveries
 
 
-def main():
-    resources = get_costs()
-    billing = get_billing()
+def run_report(send=True):
+    """Build the report and send it, returns a summary of the run"""
+    now = datetime.now(timezone.utc)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        trend_data = pool.submit(load_trends, now.date())
+        source, results = fetch_report_data()
+        trend_data = trend_data.result()
     
-    if not billing.get("month_to_date_usage"):
+    if results is None:
         print("No billing data found - check exporter")
-        return
+        return {"status": "no_data"}
     
-    embed, severity = build_embed(resources, billing)
+    resources = get_costs(results["resources"])
+    billing = get_billing(results["billing"], results["balance"])
+    
+    pvc_map = get_pvc_service_map(results["pvcs"])
+    accrued = get_accrued_mtd(results.get("accrued", []))
+    trends = compute_trends(trend_data, now, billing["month_to_date_usage"]) if trend_data else None
+    embed, severity = build_embed(resources, billing, pvc_map, accrued, trends)
     
     # Print summary for logs
     mtd = billing.get("month_to_date_usage", 0)
-    print(f"Cost Report: MTD ${mtd:.2f} (severity: {severity})")
+    print(f"Cost Report: MTD ${mtd:.2f} (severity: {severity}, source: {source})")
     
-    send_to_discord(embed)
+    result = {"status": "dry_run", "source": source, "month_to_date": mtd, "severity": severity}
+    if trends and trends["forecast"] is not None:
+        result["forecast"] = round(trends["forecast"], 2)
+    if send:
+        deliveries = send_report({"embed": embed, "summary": result})
+        result["status"] = "sent" if all(d["ok"] for d in deliveries) else "failed"
+        result["deliveries"] = {d["sink"]: d["ok"] for d in deliveries}
+    return result
+
+
+class CronSchedule:
+    """Five-field cron expression (minute hour day-of-month month day-of-week)
+
+    Fields accept *, numbers, ranges, lists and steps. As in cron, when both
+    day fields are restricted a day matching either one is due; a field
+    starting with * (*/2 included) is not restricted.
+    """
+
+    # Day-of-week 7 is Sunday like 0
+    BOUNDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression needs 5 fields: {expression!r}")
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self.parse(field, low, high) for field, (low, high) in zip(fields, self.BOUNDS)
+        )
+        self.weekdays = {day % 7 for day in self.weekdays}
+        self.any_day = fields[2].startswith("*")
+        self.any_weekday = fields[4].startswith("*")
+
+    @staticmethod
+    def parse(field, low, high):
+        values = set()
+        for part in field.split(","):
+            body, _, step = part.partition("/")
+            step = int(step) if step else 1
+            if body == "*":
+                start, end = low, high
+            elif "-" in body:
+                start, end = (int(v) for v in body.split("-", 1))
+            else:
+                start = int(body)
+                end = high if step > 1 else start
+            if not low <= start <= end <= high:
+                raise ValueError(f"cron field {field!r} out of range {low}-{high}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def day_matches(self, moment):
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, moment):
+        """First due minute strictly after `moment`"""
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 5)
+        while moment < limit:
+            if moment.month not in self.months or not self.day_matches(moment):
+                moment = (moment + timedelta(days=1)).replace(hour=0, minute=0)
+            elif moment.hour not in self.hours:
+                moment = (moment + timedelta(hours=1)).replace(minute=0)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError("cron expression never matches")
+
+
+_run_lock = threading.Lock()
+
+
+def run_locked(send=True):
+    """Run a report unless one is already running, returns None when busy"""
+    if not _run_lock.acquire(blocking=False):
+        return None
+    try:
+        return run_report(send)
+    finally:
+        _run_lock.release()
+
+
+def run_schedule(schedule):
+    while True:
+        due = schedule.next_after(datetime.now(timezone.utc))
+        print(f"Next report at {due.isoformat()}")
+        time.sleep(max(0, (due - datetime.now(timezone.utc)).total_seconds()))
+        try:
+            if run_locked() is None:
+                print("Skipping scheduled report, one is already running")
+        except Exception as e:
+            print(f"Scheduled report failed: {e}")
+
+
+class ReportHandler(BaseHTTPRequestHandler):
+    """POST /report runs a report now (?dry_run=1 skips delivery), GET /healthz"""
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/healthz":
+            return self.send_json(200, {"status": "ok"})
+        self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/report":
+            return self.send_json(404, {"error": "not found"})
+        dry_run = parse_qs(url.query).get("dry_run", ["0"])[0] not in ("0", "false", "")
+        try:
+            result = run_locked(send=not dry_run)
+        except Exception as e:
+            return self.send_json(502, {"error": str(e)})
+        if result is None:
+            return self.send_json(409, {"error": "a report is already running"})
+        self.send_json(200, result)
+
+    def log_message(self, format, *args):
+        if not self.path.startswith("/healthz"):
+            super().log_message(format, *args)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve():
+    schedule = CronSchedule(REPORT_SCHEDULE)
+    server = ThreadingHTTPServer(("", REPORT_PORT), ReportHandler)
+    server.daemon_threads = True
+    threading.Thread(target=run_schedule, args=(schedule,), daemon=True).start()
+    print(f"Serving reports on port {REPORT_PORT}, schedule {REPORT_SCHEDULE!r} (UTC)")
+    server.serve_forever()
+
+
+def main():
+    if "--serve" in sys.argv[1:]:
+        serve()
+    else:
+        run_report()
 
 
 if __name__ == "__main__":
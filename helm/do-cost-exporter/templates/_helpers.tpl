@@ -0,0 +1,81 @@
+{{/*
+Comma-separated names of the enabled exporter collectors
+*/}}
+{{- define "do-cost-exporter.collectors" -}}
+{{- $enabled := list -}}
+{{- range $name, $on := .Values.collectors -}}
+{{- if $on -}}
+{{- $enabled = append $enabled $name -}}
+{{- end -}}
+{{- end -}}
+{{- join "," $enabled -}}
+{{- end -}}
+
+{{/*
+Comma-separated names of the DigitalOcean accounts to collect
+*/}}
+{{- define "do-cost-exporter.accounts" -}}
+{{- $names := list -}}
+{{- range .Values.do.accounts -}}
+{{- $names = append $names .name -}}
+{{- end -}}
+{{- join "," $names -}}
+{{- end -}}
+
+{{/*
+Environment of the report sinks and delivery, shared by the sidecar and the CronJob
+*/}}
+{{- define "do-cost-exporter.reportSinkEnv" -}}
+- name: DISCORD_WEBHOOK
+  valueFrom:
+    secretKeyRef:
+      name: {{ .Values.discord.secretName }}
+      key: {{ .Values.discord.secretKey }}
+{{- with .Values.report.sinks.slack }}
+{{- if .secretName }}
+- name: SLACK_WEBHOOK
+  valueFrom:
+    secretKeyRef:
+      name: {{ .secretName }}
+      key: {{ .secretKey }}
+{{- end }}
+{{- end }}
+{{- if .Values.report.sinks.webhook.url }}
+- name: REPORT_WEBHOOK_URL
+  value: {{ .Values.report.sinks.webhook.url | quote }}
+{{- end }}
+{{- with .Values.report.sinks.spaces }}
+{{- if .bucket }}
+- name: SPACES_BUCKET
+  value: {{ .bucket | quote }}
+- name: SPACES_ENDPOINT
+  value: {{ .endpoint | quote }}
+- name: SPACES_REGION
+  value: {{ .region | quote }}
+- name: SPACES_PREFIX
+  value: {{ .prefix | quote }}
+- name: SPACES_ACCESS_KEY_ID
+  valueFrom:
+    secretKeyRef:
+      name: {{ .secretName }}
+      key: access_key_id
+- name: SPACES_SECRET_ACCESS_KEY
+  valueFrom:
+    secretKeyRef:
+      name: {{ .secretName }}
+      key: secret_access_key
+{{- end }}
+{{- end }}
+- name: DELIVERY_RETRIES
+  value: "{{ .Values.report.delivery.retries }}"
+- name: DELIVERY_MAX_WAIT
+  value: "{{ .Values.report.delivery.maxWait }}"
+{{- if .Values.report.delivery.pushgatewayUrl }}
+- name: PUSHGATEWAY_URL
+  value: {{ .Values.report.delivery.pushgatewayUrl | quote }}
+{{- end }}
+{{- if .Values.report.delivery.metricsFile }}
+- name: REPORT_METRICS_FILE
+  value: {{ .Values.report.delivery.metricsFile | quote }}
+{{- end }}
+{{- end -}}
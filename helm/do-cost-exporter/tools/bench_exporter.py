@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""Synthetic-fleet benchmark for the exporter collection and /metrics rendering
+
+Each fleet size is collected from tools/fake_do_api.py in a fresh
+subprocess, so peak RSS is measured per size. A fleet of size N has N
+droplets, N volumes and N/50 load balancers.
+
+    python tools/bench_exporter.py --sizes 100,1000,10000,50000 --output bench.json
+    python tools/bench_exporter.py --compare bench.json --output bench-new.json
+
+Needs the exporter dependencies (prometheus-client, aiohttp).
+"""
+import os
+import sys
+import json
+import gzip
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+FILES_DIR = os.path.join(os.path.dirname(TOOLS_DIR), "files")
+sys.path.insert(0, TOOLS_DIR)
+
+from fake_do_api import FakeDOAPI  # noqa: E402
+
+SIZES = [{"slug": f"s-{n}vcpu-{2 * n}gb", "vcpus": n, "memory": 2048 * n, "disk": 25 * n,
+          "price_monthly": 12.0 * n, "regions": ["sgp1", "nyc3", "fra1"]} for n in (1, 2, 4, 8)]
+
+
+def synthetic_fleet(size):
+    """Fixtures of an account with `size` droplets and volumes"""
+    regions = ["sgp1", "nyc3", "fra1"]
+    droplets = [
+        {
+            "id": 100000 + i,
+            "name": f"pool-{i // 100}-node-{i}",
+            "region": {"slug": regions[i % 3]},
+            "size_slug": SIZES[i % 4]["slug"],
+            "size": SIZES[i % 4],
+            "status": "active",
+            "tags": ["k8s", f"k8s:pool-{i // 100}"],
+        }
+        for i in range(size)
+    ]
+    volumes = [
+        {
+            "id": f"0a1b2c3d-0000-4000-8000-{i:012d}",
+            "name": f"pvc-0a1b2c3d-0000-4000-8000-{i:012d}",
+            "region": {"slug": regions[i % 3]},
+            "size_gigabytes": 10 * (1 + i % 10),
+            "droplet_ids": [100000 + i],
+        }
+        for i in range(size)
+    ]
+    load_balancers = [
+        {"id": f"lb-{i}", "name": f"lb-{i}", "region": {"slug": regions[i % 3]}, "size_unit": 1 + i % 3}
+        for i in range(max(1, size // 50))
+    ]
+    return {
+        "/v2/droplets": {"droplets": droplets},
+        "/v2/volumes": {"volumes": volumes},
+        "/v2/load_balancers": {"load_balancers": load_balancers},
+        "/v2/sizes": {"sizes": SIZES},
+        "/v2/kubernetes/clusters": {"kubernetes_clusters": []},
+        "/v2/databases": {"databases": []},
+        "/v2/snapshots": {"snapshots": []},
+        "/v2/reserved_ips": {"reserved_ips": []},
+        "/v2/customers/my/balance": {"month_to_date_usage": "1234.56", "account_balance": "0.00"},
+        "/v2/customers/my/invoices": {"invoice_preview": {}},
+    }
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_child(url):
+    """Collect once from `url` and print measurements as JSON"""
+    sys.path.insert(0, FILES_DIR)
+    import exporter
+    from prometheus_client import REGISTRY, generate_latest
+
+    logging.getLogger("exporter").setLevel(logging.WARNING)
+    rss_start = peak_rss_mb()
+
+    async def collect():
+        async with exporter.create_session() as session:
+            client = exporter.DOClient(session, "bench", "bench")
+            return await exporter.collect_metrics(client, exporter.Snapshot())
+
+    start = time.perf_counter()
+    snapshot = asyncio.run(collect())
+    collection_s = time.perf_counter() - start
+    exporter.cost_collector.publish("bench", snapshot)
+    resources = sum(1 for _ in snapshot.resources())
+
+    start = time.perf_counter()
+    payload = generate_latest(REGISTRY)
+    render_s = time.perf_counter() - start
+
+    # A gzip scrape through the metrics cache: the first renders, the next is served from the cache
+    start = time.perf_counter()
+    exporter.metrics_cache.get(None, True)
+    first_scrape_s = time.perf_counter() - start
+    start = time.perf_counter()
+    exporter.metrics_cache.get(None, True)
+    cached_scrape_s = time.perf_counter() - start
+    rss_peak = peak_rss_mb()
+
+    # Second, traced pass: tracing slows collection down so it is not timed
+    tracemalloc.start()
+    traced = asyncio.run(collect())
+    retained = tracemalloc.take_snapshot().statistics("filename")
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del traced
+
+    print(json.dumps({
+        "resources": resources,
+        "collection_seconds": round(collection_s, 4),
+        "render_seconds": round(render_s, 4),
+        "first_scrape_seconds": round(first_scrape_s, 4),
+        "cached_scrape_seconds": round(cached_scrape_s, 6),
+        "payload_bytes": len(payload),
+        "payload_gzip_bytes": len(gzip.compress(payload)),
+        "rss_start_mb": round(rss_start, 1),
+        "rss_peak_mb": round(rss_peak, 1),
+        "retained_blocks_per_resource": round(sum(s.count for s in retained) / max(resources, 1), 2),
+        "retained_bytes_per_resource": round(sum(s.size for s in retained) / max(resources, 1), 1),
+        "traced_peak_bytes_per_resource": round(traced_peak / max(resources, 1), 1),
+    }))
+
+
+def bench(size, args):
+    api = FakeDOAPI(synthetic_fleet(size), latency=args.latency / 1000)
+    url = api.start()
+    try:
+        with tempfile.TemporaryDirectory() as data_dir:
+            env = {**os.environ, "DO_API_URL": url, "DATA_DIR": data_dir, "PAGE_CONCURRENCY": str(args.page_concurrency)}
+            child = subprocess.run(
+                [sys.executable, __file__, "--child", url],
+                env=env, capture_output=True, text=True, check=True,
+            )
+    finally:
+        api.stop()
+    result = json.loads(child.stdout.strip().splitlines()[-1])
+    result["fleet_size"] = size
+    result["api_requests"] = sum(api.requests.values())
+    result["warnings"] = child.stderr.count(" - WARNING - ") + child.stderr.count(" - ERROR - ")
+    result["within_memory_limit"] = result["rss_peak_mb"] <= args.memory_limit_mb
+    return result
+
+
+def compare(baseline, results):
+    previous = {r["fleet_size"]: r for r in baseline["results"]}
+    keys = ("collection_seconds", "render_seconds", "payload_bytes", "rss_peak_mb")
+    print(f"{'size':>8} " + " ".join(f"{k:>22}" for k in keys))
+    for r in results:
+        before = previous.get(r["fleet_size"])
+        if before is None:
+            continue
+        cells = []
+        for k in keys:
+            change = (r[k] - before[k]) / before[k] * 100 if before[k] else 0
+            cells.append(f"{r[k]:>12} ({change:+6.1f}%)")
+        print(f"{r['fleet_size']:>8} " + " ".join(f"{c:>22}" for c in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark exporter collection and /metrics rendering on synthetic fleets")
+    parser.add_argument("--sizes", default="100,1000,10000,50000", help="comma-separated fleet sizes")
+    parser.add_argument("--latency", type=float, default=0, help="fake API latency per request, in ms")
+    parser.add_argument("--page-concurrency", type=int, default=4)
+    parser.add_argument("--memory-limit-mb", type=float, default=128, help="container memory limit to check against")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="previous JSON results to compare against")
+    parser.add_argument("--child", metavar="URL", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(args.child)
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        result = bench(size, args)
+        results.append(result)
+        print(
+            f"{size:>6}: collect {result['collection_seconds']:.2f}s, render {result['render_seconds']:.3f}s, "
+            f"payload {result['payload_bytes'] / 1024:.0f}KiB, peak RSS {result['rss_peak_mb']:.0f}MiB"
+            f"{'' if result['within_memory_limit'] else ' (over limit)'}",
+            file=sys.stderr,
+        )
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "memory_limit_mb": args.memory_limit_mb,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
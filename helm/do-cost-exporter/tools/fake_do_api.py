@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""Local stand-in for api.digitalocean.com replaying recorded fixtures
+
+Record fixtures from a real account (the token is redacted):
+    RECORD_DIR=fixtures DATA_DIR=/tmp/do-cost DO_API_TOKEN=... python files/exporter.py
+
+Replay them with latency, pagination, rate limiting and errors:
+    python tools/fake_do_api.py fixtures/default --port 9000 --latency 80 --page-size 50 --rate-limit 250 --error-rate 0.02
+    DO_API_URL=http://localhost:9000 DO_API_TOKEN=fake python files/exporter.py
+
+Stdlib only, so it runs in CI without installing anything.
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger("fake_do_api")
+
+
+def list_key(body):
+    """Name of the resource list in a DO list response, None for single objects"""
+    if not isinstance(body, dict):
+        return None
+    for key, value in body.items():
+        if key not in ("links", "meta") and isinstance(value, list):
+            return key
+    return None
+
+
+def load_fixtures(directory):
+    """Read fixtures recorded by the exporter, merging the pages of each path
+
+    Error responses are skipped, they would otherwise be replayed as 200s.
+    """
+    fixtures = {}
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(directory, name)) as f:
+            fixture = json.load(f)
+        if not 200 <= fixture.get("status", 200) < 300:
+            continue
+        path, body = fixture["path"], fixture["body"]
+        key = list_key(body)
+        if key and path in fixtures:
+            fixtures[path][key].extend(body[key])
+        else:
+            fixtures[path] = body
+    return fixtures
+
+
+class FakeDOAPI:
+    """Serves fixture bodies by path with injectable latency and failures
+
+    `fixtures` maps an API path to its response body. List bodies are
+    re-paginated on every request, honouring page/per_page capped to
+    `page_size`. `rate_limit` requests are allowed per `rate_window` seconds
+    and answered with ratelimit-* headers, 429 once spent. `error_rate` is the
+    probability of a 500.
+    """
+
+    def __init__(self, fixtures, latency=0.0, jitter=0.0, page_size=None, rate_limit=0,
+                 rate_window=60.0, error_rate=0.0, seed=None):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.page_size = page_size
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.window_start = time.time()
+        self.window_count = 0
+        self.requests = {}
+        self.server = None
+
+    def take_budget(self):
+        """Count a request against the rate limit window, returns (allowed, remaining, reset)"""
+        with self.lock:
+            now = time.time()
+            if now - self.window_start >= self.rate_window:
+                self.window_start, self.window_count = now, 0
+            self.window_count += 1
+            reset = int(self.window_start + self.rate_window)
+            if not self.rate_limit:
+                return True, 5000, reset
+            return self.window_count <= self.rate_limit, max(0, self.rate_limit - self.window_count), reset
+
+    def respond(self, path, query):
+        """Return (status, headers, body) for a GET request"""
+        with self.lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self.random.uniform(0, self.jitter))
+
+        allowed, remaining, reset = self.take_budget()
+        headers = {
+            "ratelimit-limit": str(self.rate_limit or 5000),
+            "ratelimit-remaining": str(remaining),
+            "ratelimit-reset": str(reset),
+        }
+        if not allowed:
+            headers["Retry-After"] = str(max(1, reset - int(time.time())))
+            return 429, headers, {"id": "too_many_requests", "message": "API Rate limit exceeded."}
+        if self.error_rate and self.random.random() < self.error_rate:
+            return 500, headers, {"id": "server_error", "message": "Injected failure."}
+
+        body = self.fixtures.get(path)
+        if body is None:
+            return 404, headers, {"id": "not_found", "message": "The resource you were accessing could not be found."}
+
+        key = list_key(body)
+        if key is None:
+            return 200, headers, body
+
+        items = body[key]
+        per_page = int(query.get("per_page", ["20"])[0])
+        if self.page_size:
+            per_page = min(per_page, self.page_size)
+        page = int(query.get("page", ["1"])[0])
+        pages = {}
+        if page * per_page < len(items):
+            pages["next"] = f"{path}?page={page + 1}&per_page={per_page}"
+        # Other top-level keys (the invoices' invoice_preview) are kept as recorded
+        return 200, headers, {
+            **body,
+            key: items[(page - 1) * per_page:page * per_page],
+            "links": {"pages": pages},
+            "meta": {**body.get("meta", {}), "total": len(items)},
+        }
+
+    def handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                status, headers, body = api.respond(url.path, parse_qs(url.query))
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        return Handler
+
+    def start(self, host="127.0.0.1", port=0):
+        """Serve in a background thread, returns the base URL"""
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://{host}:{self.server.server_address[1]}"
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Replay recorded DigitalOcean API fixtures")
+    parser.add_argument("fixtures", help="directory of fixtures recorded with RECORD_DIR")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0, help="fixed latency per request, in ms")
+    parser.add_argument("--jitter", type=float, default=0, help="random extra latency per request, in ms")
+    parser.add_argument("--page-size", type=int, default=None, help="maximum items per page")
+    parser.add_argument("--rate-limit", type=int, default=0, help="requests allowed per window, 0 for unlimited")
+    parser.add_argument("--rate-window", type=float, default=60, help="rate limit window, in seconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="probability of answering 500")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    api = FakeDOAPI(
+        load_fixtures(args.fixtures),
+        latency=args.latency / 1000,
+        jitter=args.jitter / 1000,
+        page_size=args.page_size,
+        rate_limit=args.rate_limit,
+        rate_window=args.rate_window,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    url = api.start(args.host, args.port)
+    logger.info(f"Serving {len(api.fixtures)} fixtures on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        api.stop()
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
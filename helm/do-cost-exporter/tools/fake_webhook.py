@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""Local stand-in for the report sinks (Discord, Slack, webhooks, Spaces)
+
+Accepts any POST or PUT, records it and answers with injectable latency,
+rate limiting and errors. GET /requests lists what was received.
+
+    python tools/fake_webhook.py --port 9100 --rate-limit 2 --error-rate 0.2
+    DISCORD_WEBHOOK=http://localhost:9100/discord SLACK_WEBHOOK=http://localhost:9100/slack \
+        SPACES_ENDPOINT=http://localhost:9100 SPACES_BUCKET=reports PUSHGATEWAY_URL=http://localhost:9100 \
+        python files/report.py
+    curl localhost:9100/requests
+
+Stdlib only, so it runs in CI without installing anything.
+"""
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger("fake_webhook")
+
+
+class FakeWebhook:
+    """Records deliveries, answering 429 or 500 as configured
+
+    Every `rate_limit`-th request of a path is answered 429 with
+    Retry-After `retry_after` and a Discord-style retry_after body.
+    `error_rate` is the probability of a 500. Paths in `statuses` are
+    always answered with their status.
+    """
+
+    def __init__(self, latency=0.0, rate_limit=0, retry_after=0.5, error_rate=0.0, statuses=None, seed=None):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.statuses = statuses or {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.received = []
+        self.server = None
+
+    def respond(self, method, path, headers, body):
+        """Return (status, headers, body) for a POST or PUT"""
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            count = self.counts[path] = self.counts.get(path, 0) + 1
+        if path in self.statuses:
+            return self.statuses[path], {}, {"message": "Injected status."}
+        if self.rate_limit and count % self.rate_limit == 0:
+            return 429, {"Retry-After": f"{self.retry_after:g}"}, {"message": "You are being rate limited.",
+                                                                   "retry_after": self.retry_after}
+        if self.error_rate and self.random.random() < self.error_rate:
+            return 500, {}, {"message": "Injected failure."}
+
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            payload = body.decode(errors="replace")
+        with self.lock:
+            self.received.append({"method": method, "path": path, "time": time.time(),
+                                  "authorization": headers.get("Authorization"), "body": payload})
+        return 200, {}, {"ok": True}
+
+    def handler(self):
+        hook = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if self.path != "/requests":
+                    return self.send(404, {}, {"message": "not found"})
+                with hook.lock:
+                    received = list(hook.received)
+                self.send(200, {}, received)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self.send(*hook.respond(self.command, self.path, self.headers, body))
+
+            do_PUT = do_POST
+
+            def send(self, status, headers, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        return Handler
+
+    def start(self, host="127.0.0.1", port=0):
+        """Serve in a background thread, returns the base URL"""
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://{host}:{self.server.server_address[1]}"
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Record report deliveries with injectable failures")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0, help="fixed latency per request, in ms")
+    parser.add_argument("--rate-limit", type=int, default=0, help="answer 429 to every Nth request of a path, 0 for never")
+    parser.add_argument("--retry-after", type=float, default=0.5, help="Retry-After of the 429s, in seconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="probability of answering 500")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    hook = FakeWebhook(
+        latency=args.latency / 1000,
+        rate_limit=args.rate_limit,
+        retry_after=args.retry_after,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    url = hook.start(args.host, args.port)
+    logger.info(f"Recording deliveries on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        hook.stop()
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Generate the chart's PrometheusRule from the report's aggregations
+
+The report's AGGREGATES table (files/report.py) is recorded as is, plus the
+per-service and per-namespace aggregates the dashboards use. Rerun after
+changing either table:
+
+    python tools/gen_recording_rules.py           # rewrite templates/prometheusrule.yaml
+    python tools/gen_recording_rules.py --check   # exit 1 when it is out of date
+
+Stdlib only, like report.py which it imports.
+"""
+import os
+import sys
+import json
+import argparse
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+CHART_DIR = os.path.dirname(TOOLS_DIR)
+sys.path.insert(0, os.path.join(CHART_DIR, "files"))
+
+from report import AGGREGATES  # noqa: E402
+
+OUTPUT = os.path.join(CHART_DIR, "templates", "prometheusrule.yaml")
+
+# Volume cost per service (the claim's app label, or its name) and cost per
+# namespace, summed over accounts
+DASHBOARD_AGGREGATES = {
+    "services": (
+        "do_cost:pvc_cost:sum_by_service",
+        'sum by (namespace, app) (label_replace(do_cost_exporter_pvc_cost{app=""}, "app", "$1", '
+        '"persistentvolumeclaim", "(.*)") or do_cost_exporter_pvc_cost{app!=""})',
+    ),
+    "namespaces": ("do_cost:namespace_cost:sum_by_namespace", "sum by (namespace) (do_cost_exporter_namespace_cost)"),
+}
+
+
+def render():
+    lines = [
+        "{{- if .Values.recordingRules.enabled }}",
+        "# Generated by tools/gen_recording_rules.py from files/report.py, do not edit",
+        "apiVersion: monitoring.coreos.com/v1",
+        "kind: PrometheusRule",
+        "metadata:",
+        "  name: do-cost-exporter",
+        "  namespace: {{ .Release.Namespace }}",
+        "  labels:",
+        "    app: do-cost-exporter",
+        "spec:",
+        "  groups:",
+        "  - name: do-cost-exporter.rules",
+        "    interval: {{ .Values.recordingRules.interval }}",
+        "    rules:",
+    ]
+    for record, expression in (*AGGREGATES.values(), *DASHBOARD_AGGREGATES.values()):
+        # JSON strings are valid YAML double-quoted scalars
+        lines.append(f"    - record: {record}")
+        lines.append(f"      expr: {json.dumps(expression)}")
+    lines.append("{{- end }}")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the PrometheusRule of the report's aggregations")
+    parser.add_argument("--check", action="store_true", help="fail instead of writing when the file is out of date")
+    parser.add_argument("--output", default=OUTPUT)
+    args = parser.parse_args()
+
+    content = render()
+    if args.check:
+        try:
+            with open(args.output) as f:
+                current = f.read()
+        except FileNotFoundError:
+            current = None
+        if current != content:
+            print(f"{args.output} is out of date, run tools/gen_recording_rules.py", file=sys.stderr)
+            return 1
+        return 0
+
+    with open(args.output, "w") as f:
+        f.write(content)
+    print(f"Wrote {len(AGGREGATES) + len(DASHBOARD_AGGREGATES)} rules to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,14 +6,19 @@
 
 import sys
 import os
+import time
 import logging
+import threading
 import subprocess
 
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from itertools import groupby, chain
 from more_itertools import partition
-from functools import cache
+from urllib.parse import urlparse
 import argparse
 import requests
+from requests.adapters import HTTPAdapter
 import hashlib
 from datetime import datetime
 from ruamel.yaml import YAML
@@ -50,15 +55,53 @@ arch_alt_name = {
     "no_arch": None,
 }
 
+def hash_stream(
+    response: requests.Response, hashtype: str, chunk_size: int, readinto: bool
+) -> (str, int):
+    """Hash a streamed response chunk by chunk, returns (hexdigest, size)
+
+    Memory stays at one chunk whatever the artifact size. With readinto an
+    unencoded body is read from the underlying http.client response into a
+    single reused buffer, skipping urllib3 whose readinto copies through
+    read(). Encoded bodies are decoded by iter_content either way.
+    """
+    hasher = hashlib.new(hashtype)
+    size = 0
+    if readinto and response.headers.get("Content-Encoding", "identity") == "identity":
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        # Private urllib3 attribute (HTTPResponse._fp, the http.client response):
+        # urllib3's length enforcement and connection release are done here instead
+        while read := response.raw._fp.readinto(buffer):
+            hasher.update(view[:read])
+            size += read
+        expected = response.headers.get("Content-Length")
+        if expected is not None and int(expected) != size:
+            raise requests.exceptions.ChunkedEncodingError(
+                f"{response.url}: got {size} bytes, expected {expected}"
+            )
+        response.raw.release_conn()
+    else:
+        for chunk in response.iter_content(chunk_size):
+            hasher.update(chunk)
+            size += len(chunk)
+    return hasher.hexdigest(), size
+
+
 # TODO: downloads not supported
 # helm_archive: PGP signatures
 
 # TODO:
 # different verification methods (gpg, cosign) ( needs download role changes) (or verify the sig in this script and only use the checksum in the playbook)
-# perf improvements (async)
 
 
-def download_hash(downloads: {str: {str: Any}}) -> None:
+def download_hash(
+    downloads: {str: {str: Any}},
+    workers: int = 16,
+    per_host: int = 4,
+    chunk_size: int = 1 << 20,
+    readinto: bool = False,
+) -> None:
     # Handle file with multiples hashes, with various formats.
     # the lambda is expected to produce a dictionary of hashes indexed by arch name
     download_hash_extract = {
@@ -109,19 +152,7 @@ def download_hash(downloads: {str: {str: Any}}) -> None:
     logger.info("Opening checksums file %s...", checksums_file)
     data, yaml = open_yaml(checksums_file)
     s = requests.Session()
-
-    @cache
-    def _get_hash_by_arch(download: str, version: str) -> {str: str}:
-
-        hash_file = s.get(
-            downloads[download]["url"].format(
-                version=version,
-                os="linux",
-            ),
-            allow_redirects=True,
-        )
-        hash_file.raise_for_status()
-        return download_hash_extract[download](hash_file.content.decode())
+    s.mount("https://", HTTPAdapter(pool_maxsize=workers))
 
     releases, tags = map(
         dict, partition(lambda r: r[1].get("tags", False), downloads.items())
@@ -225,34 +256,88 @@ def download_hash(downloads: {str: {str: Any}}) -> None:
         if (c := component.removesuffix("_checksums")) in downloads.keys()
     }
 
-    def get_hash(component: str, version: Version, arch: str):
-        if component in download_hash_extract:
-            hashes = _get_hash_by_arch(component, version)
-            return hashes[arch]
-        else:
-            hash_file = s.get(
-                downloads[component]["url"].format(
-                    version=version,
-                    os="linux",
-                    arch=arch,
-                    alt_arch=arch_alt_name[arch],
-                ),
-                allow_redirects=True,
-            )
+    def hash_url(component: str, version: Version, arch: str) -> str:
+        return downloads[component]["url"].format(
+            version=version,
+            os="linux",
+            arch=arch,
+            alt_arch=arch_alt_name[arch],
+        )
+
+    # Connections to a single host are bounded, whatever the pool size
+    host_slots = defaultdict(lambda: threading.BoundedSemaphore(per_host))
+    host_slots_lock = threading.Lock()
+
+    def fetch(component: str, url: str) -> str | dict[str, str]:
+        with host_slots_lock:
+            slot = host_slots[urlparse(url).netloc]
+        # Binaries are hashed as they download, they can be hundreds of MB
+        binary = downloads[component].get("binary", False)
+        with slot, s.get(url, allow_redirects=True, stream=binary) as hash_file:
             hash_file.raise_for_status()
-            if downloads[component].get("binary", False):
-                return hashlib.new(
-                    downloads[component].get("hashtype", "sha256"), hash_file.content
-                ).hexdigest()
-            return hash_file.content.decode().split()[0]
+            if binary:
+                start = time.monotonic()
+                digest, size = hash_stream(
+                    hash_file,
+                    downloads[component].get("hashtype", "sha256"),
+                    chunk_size,
+                    readinto,
+                )
+                elapsed = max(time.monotonic() - start, 1e-6)
+                logger.info(
+                    "Hashed %s: %.1f MiB in %.1fs (%.1f MiB/s)",
+                    url,
+                    size / (1 << 20),
+                    elapsed,
+                    size / (1 << 20) / elapsed,
+                )
+                return digest
+            content = hash_file.content.decode()
+        if component in download_hash_extract:
+            return download_hash_extract[component](content)
+        return content.split()[0]
+
+    # Each URL is fetched once even when several (component, version, arch)
+    # need it: multi-hash files, archives not specific to an arch
+    targets = [
+        (component, version, arch, hash_url(component, version, arch))
+        for component, versions in chain(new_versions.items(), hash_set_to_0.items())
+        for arch in components_supported_arch[component]
+        for version in sorted(versions)
+    ]
+    in_flight: {str: Future} = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for component, _, _, url in targets:
+            if url not in in_flight:
+                in_flight[url] = pool.submit(fetch, component, url)
+        logger.info(
+            "Fetching %d hashes from %d URLs (%d workers, %d per host)...",
+            len(targets),
+            len(in_flight),
+            workers,
+            per_host,
+        )
+        step = max(1, len(in_flight) // 10)
+        try:
+            for done, future in enumerate(as_completed(in_flight.values()), 1):
+                future.result()
+                if done % step == 0 or done == len(in_flight):
+                    logger.info("Fetched %d/%d URLs", done, len(in_flight))
+        except BaseException:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    # Merged in the order of the targets, independent of completion order
+    for component, version, arch, url in targets:
+        result = in_flight[url].result()
+        if component in download_hash_extract:
+            result = result[arch]
+        data[component + "_checksums"][arch][
+            str(version)
+        ] = f"{downloads[component].get('hashtype', 'sha256')}:{result}"
 
-    for component, versions in chain(new_versions.items(), hash_set_to_0.items()):
+    for component in chain(new_versions.keys(), hash_set_to_0.keys()):
         c = component + "_checksums"
-        for arch in components_supported_arch[component]:
-            for version in versions:
-                data[c][arch][
-                    str(version)
-                ] = f"{downloads[component].get('hashtype', 'sha256')}:{get_hash(component, version, arch)}"
 
         data[c] = {
             arch: {
@@ -325,7 +410,37 @@ def main():
         default=[],
     )
 
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help="number of downloads in parallel",
+        default=16,
+    )
+    parser.add_argument(
+        "--per-host",
+        type=int,
+        help="maximum number of parallel downloads from a single host",
+        default=4,
+    )
+
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        help="bytes read at a time when hashing binary downloads",
+        default=1 << 20,
+    )
+    parser.add_argument(
+        "--readinto",
+        action="store_true",
+        help="read unencoded binary downloads straight into a single reused buffer",
+    )
+
     args = parser.parse_args()
     download_hash(
-        {k: components.infos[k] for k in (set(args.only) - set(args.exclude))}
+        {k: components.infos[k] for k in (set(args.only) - set(args.exclude))},
+        workers=args.workers,
+        per_host=args.per_host,
+        chunk_size=args.chunk_size,
+        readinto=args.readinto,
     )